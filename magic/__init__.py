@@ -18,9 +18,24 @@ Usage:
 
 import sys
 import os
+import stat
 import threading
-
-from ctypes import c_char_p, c_int, c_size_t, c_void_p, byref, POINTER
+import weakref
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from itertools import count, islice
+
+from ctypes import (
+    c_char,
+    c_char_p,
+    c_int,
+    c_size_t,
+    c_void_p,
+    byref,
+    cast,
+    Array,
+    POINTER,
+)
 
 
 class MagicException(Exception):
@@ -29,6 +44,107 @@ class MagicException(Exception):
         self.message = message
 
 
+CacheInfo = namedtuple("CacheInfo", ("hits", "misses", "maxsize", "currsize"))
+
+
+class _LRUCache:
+    """
+    A bounded, thread-safe mapping that evicts the least recently used
+    entry and counts hits and misses.
+    """
+
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError("cache size must be at least 1")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+
+class Detection:
+    """
+    The result of Magic.detect.  Fields that weren't asked for are None.
+    """
+
+    __slots__ = ("mime_type", "encoding", "name", "extension")
+
+    def __init__(self, mime_type=None, encoding=None, name=None, extension=None):
+        self.mime_type = mime_type
+        self.encoding = encoding
+        self.name = name
+        self.extension = extension
+
+    def __eq__(self, other):
+        if not isinstance(other, Detection):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return "Detection(%s)" % ", ".join(
+            "%s=%r" % (f, getattr(self, f)) for f in self.__slots__
+        )
+
+
+class _ResultIds:
+    """
+    Maps each distinct libmagic result to a small int, for
+    Magic(result_type="id").
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self._lock = threading.Lock()
+
+    def __call__(self, raw):
+        i = self.ids.get(raw)
+        if i is None:
+            with self._lock:
+                i = self.ids.get(raw)
+                if i is None:
+                    self.names.append(maybe_decode(raw))
+                    i = self.ids[raw] = len(self.names) - 1
+        return i
+
+
 class Magic:
     """
     Magic is a wrapper around the libmagic C library.
@@ -54,6 +170,18 @@ class Magic:
         check_encoding=True,
         check_json=True,
         check_simh=True,
+        file_cache=None,
+        cache=None,
+        cache_safe=True,
+        compile_cache=False,
+        shared_database=None,
+        stats=False,
+        hooks=None,
+        fast_path=False,
+        fast_path_verify=None,
+        result_type="str",
+        intern_results=False,
+        index=None,
     ):
         """
         Create a new libmagic wrapper.
@@ -62,10 +190,47 @@ class Magic:
         mime_encoding - if True, codec is returned
         magic_file - use a mime database other than the system default
         keep_going - don't stop at the first match, keep going
-        uncompress - Try to look inside compressed files.
+        uncompress - Try to look inside compressed files.  "python"
+            decompresses gzip, bzip2, xz, zstd and lz4 in this process
+            instead, without libmagic forking external decompressors,
+            and only as far as libmagic would examine.
         raw - Do not try to decode "non-printable" chars.
         extension - Print a slash-separated list of valid extensions for the file type found.
+        file_cache - remember this many from_file and from_files results,
+            keyed by the file's device, inode, size and mtime
+        cache - remember this many from_buffer and from_buffers results,
+            keyed by a hash of the part of the buffer libmagic examines
+        cache_safe - don't cache buffers longer than MAGIC_PARAM_BYTES_MAX
+            when uncompress is set, since decompression looks past it
+        compile_cache - compile text sources in magic_file once and load
+            the cached .mgc from then on.  True uses the default cache
+            directory, a string names the directory.
+        shared_database - load the database from memory shared with every
+            other cookie in the process instead of giving this cookie its
+            own copy.  True shares the database for magic_file, or pass a
+            magic.database.SharedDatabase.
+        stats - count calls, bytes examined, errors and fallbacks, and
+            time lock waits and libmagic calls.  Read them with stats().
+        hooks - magic.stats.Hooks instances to call around every call
+        fast_path - with mime=True, recognise PNG, JPEG, PDF, gzip, zip and
+            MP4 from their leading bytes without calling libmagic
+        fast_path_verify - check one in this many fast path answers
+            against libmagic, and stop using signatures that disagree
+        result_type - "str" to return results as str, "bytes" to return
+            libmagic's bytes undecoded, or "id" to return a small int per
+            distinct result; result_names() maps them back to str
+        intern_results - return the same object for equal results instead
+            of decoding a new one each time.  Results are remembered for
+            the life of the instance, so this suits mime types better than
+            descriptions, which can contain sizes and other details.
+        index - path of a SQLite database (or a magic.index.Index) in which
+            from_file and from_files results are kept between runs.  Files whose stat
+            hasn't changed are answered from it without being read.
         """
+        # recorded so the instance can be pickled and rebuilt elsewhere
+        self._args = dict(locals())
+        del self._args["self"]
+
         self.flags = MAGIC_NONE
         if mime:
             self.flags |= MAGIC_MIME_TYPE
@@ -73,7 +238,7 @@ class Magic:
             self.flags |= MAGIC_MIME_ENCODING
         if keep_going:
             self.flags |= MAGIC_CONTINUE
-        if uncompress:
+        if uncompress and uncompress != "python":
             self.flags |= MAGIC_COMPRESS
         if raw:
             self.flags |= MAGIC_RAW
@@ -106,8 +271,52 @@ class Magic:
 
         self.cookie = magic_open(self.flags)
         self.lock = threading.Lock()
-
-        magic_load(self.cookie, magic_file)
+        self._file_cache = _LRUCache(file_cache) if file_cache else None
+        self._buffer_cache = None
+        self._cache_safe = cache_safe
+        if cache:
+            import hashlib
+
+            self._buffer_cache = _LRUCache(cache)
+            self._hash = hashlib.blake2b
+        self._bytes_max = None
+        self._stream_buffer = None
+        self._stream_lock = threading.Lock()
+        if compile_cache and magic_file is not None:
+            from magic.database import compile_cached
+
+            cache_dir = compile_cache if compile_cache is not True else None
+            magic_file = compile_cached(magic_file, cache_dir)
+        self._magic_file = magic_file
+        self._params = {}
+        # the params as part of a cache key
+        self._params_key = ()
+        self._detect_cookies = {}
+        self._views = {}
+        self._decode = self._make_decoder(result_type, intern_results)
+        self._uncompress = None
+        if uncompress == "python":
+            from magic import uncompress as _uncompress
+
+            self._uncompress = _uncompress
+
+        self._index = None
+        self._index_config = None
+        if index is not None:
+            from magic.index import Index
+
+            if result_type != "str":
+                raise ValueError("index needs result_type='str'")
+            self._index = index if isinstance(index, Index) else Index.get(index)
+
+        self._database = None
+        if shared_database:
+            from magic.database import SharedDatabase
+
+            if not isinstance(shared_database, SharedDatabase):
+                shared_database = SharedDatabase.get(magic_file)
+            self._database = shared_database
+        self._load_database(self.cookie)
 
         # MAGIC_EXTENSION was added in 523 or 524, so bail if
         # it doesn't appear to be available
@@ -129,55 +338,807 @@ class Magic:
                 # some versions of libmagic fail this call,
                 # so rather than fail hard just use default behavior
                 pass
+            try:
+                self._bytes_max = self.getparam(MAGIC_PARAM_BYTES_MAX)
+            except MagicException:
+                # MAGIC_PARAM_BYTES_MAX is newer than the param API itself
+                pass
+
+        self._fast_path = None
+        if fast_path:
+            self._init_fast_path(fast_path_verify)
+
+        # Instrumentation replaces methods and the lock on this instance
+        # only, so uninstrumented instances pay nothing for it.
+        self._stats = None
+        if stats or hooks:
+            from magic.stats import MagicStats, install
+
+            if stats:
+                self._stats = MagicStats()
+            install(self, self._stats, hooks or ())
+
+        _live_magic.add(self)
+
+    def stats(self, reset=False):
+        """
+        Return a dict of the counters collected with stats=True, or None
+        if they are disabled.  If `reset` is true the counters are
+        zeroed afterwards.
+
+        calls, errors - counts per entry point
+        bytes - bytes passed to libmagic, or that it will read from files
+        fallbacks - results libmagic failed to produce that were replaced
+            by application/octet-stream
+        call_time, lock_wait, lock_hold - histograms of the time spent in
+            each call, waiting for the lock, and holding it (in libmagic)
+        """
+        if self._stats is None:
+            return None
+        result = self._stats.snapshot()
+        if reset:
+            self._stats.reset()
+        return result
+
+    def from_buffer(self, buf, **flags):
+        """
+        Identify the contents of `buf`, which may be str or any object
+        supporting the buffer protocol.  Only the first
+        MAGIC_PARAM_BYTES_MAX bytes are passed to libmagic.
+
+        Keyword arguments override the constructor's flag arguments for
+        this call, e.g. from_buffer(buf, mime=True, uncompress=True).
+        The same applies to every from_ method and detect.
+        """
+        if flags:
+            return self._with_flags(flags).from_buffer(buf)
+        buf = self._buffer_arg(buf)
+        if self._fast_path is not None:
+            return self._fast_result(buf, lambda: self._buffer_result(buf))
+        return self._buffer_result(buf)
+
+    def _buffer_result(self, buf):
+        cache = self._buffer_cache
+        if cache is not None:
+            key = self._buffer_cache_key(buf)
+            if key is not None:
+                result = cache.get(key)
+                if result is not None:
+                    return result
+
+        result = None
+        if self._uncompress is not None:
+            result = self._uncompressed(buf)
+        if result is None:
+            with self.lock:
+                try:
+                    result = self._decode(magic_buffer(self.cookie, buf))
+                except MagicException as e:
+                    result = self._handle509Bug(e)
+
+        if cache is not None and key is not None:
+            cache.put(key, result)
+        return result
+
+    def _buffer_arg(self, buf):
+        # libmagic only examines the first MAGIC_PARAM_BYTES_MAX bytes of
+        # a buffer, except when decompressing.
+        limit = self._bytes_max
+        if self.flags & MAGIC_COMPRESS:
+            limit = None
+
+        # if we're on python3, convert buf to bytes
+        # otherwise this string is passed as wchar*
+        # which is not what libmagic expects
+        # NEXTBREAK: only take bytes
+        if type(buf) == str and str != bytes:
+            if limit is not None:
+                # each character encodes to at least one byte
+                buf = buf[:limit]
+            buf = buf.encode("utf-8", errors="replace")
+        return _buffer_view(buf, limit)
+
+    def _buffer_cache_key(self, buf):
+        limit = self._bytes_max
+        n = len(buf)
+        if limit is not None and n > limit:
+            # only possible with MAGIC_COMPRESS, see _buffer_arg
+            if self._cache_safe:
+                return None
+            n = limit
+            buf = memoryview(buf)[:n]
+        digest = self._hash(buf, digest_size=16).digest()
+        return (digest, n, self.flags, self._params_key, self._uncompress is not None)
+
+    def cache_info(self):
+        """
+        Return a CacheInfo of from_buffer cache statistics, or None if the
+        cache is disabled.
+        """
+        if self._buffer_cache is None:
+            return None
+        return self._buffer_cache.info()
+
+    def cache_clear(self):
+        """
+        Forget every cached from_buffer result.
+        """
+        if self._buffer_cache is not None:
+            self._buffer_cache.clear()
+
+    def from_stream(self, fobj, **flags):
+        """
+        Identify the contents of the binary file-like object `fobj`.
 
-    def from_buffer(self, buf):
+        Only as many bytes as libmagic would read from a file are read,
+        using readinto() where available.  If `fobj` is seekable its
+        position is restored afterwards.
         """
-        Identify the contents of `buf`
+        if flags:
+            return self._with_flags(flags).from_stream(fobj)
+        with self._stream_prefix(fobj) as view:
+            return self.from_buffer(view)
+
+    @contextmanager
+    def _stream_prefix(self, fobj):
+        # yield a view of the bytes libmagic would read from fobj
+        limit = self._bytes_max or _DEFAULT_BYTES_MAX
+        try:
+            pos = fobj.tell() if fobj.seekable() else None
+        except (AttributeError, OSError):
+            pos = None
+
+        # the read buffer is reused between calls, so only one stream can
+        # be read at a time
+        with self._stream_lock:
+            buf = self._stream_buffer
+            if buf is None or len(buf) < limit:
+                buf = self._stream_buffer = bytearray(limit)
+            view = memoryview(buf)[:limit]
+            try:
+                n = _read_prefix(fobj, view)
+            finally:
+                if pos is not None:
+                    fobj.seek(pos)
+            yield view[:n]
+
+    def from_archive(self, source, max_depth=1, **flags):
         """
+        Identify the members of a zip or tar archive (compressed with
+        gzip, bzip2 or xz or not) without extracting it, yielding
+        (member name, result) pairs.
+
+        source - a path or binary file-like object.  Zip archives must be
+            seekable; tars can be read from a stream.
+        max_depth - how many levels of archives inside archives to
+            descend into.  Members of nested archives are named like
+            "outer.zip/inner.tar/file".
+
+        Only the prefix libmagic would read from a file is read from each
+        member.  Members that can't be read are yielded with the
+        exception instead of a result.  Raises ValueError if `source`
+        isn't an archive.
+        """
+        from magic.archive import iter_archive
+
+        return iter_archive(self._with_flags(flags), source, max_depth)
+
+    def from_file(self, filename, **flags):
+        if flags:
+            return self._with_flags(flags).from_file(filename)
+        # raise FileNotFoundException or IOError if the file does not exist
+        st = os.stat(filename, follow_symlinks=self.flags & MAGIC_SYMLINK)
+        return self._from_file(filename, st)
+
+    def _from_file(self, filename, st):
+        # `st` is the caller's stat of filename, honouring MAGIC_SYMLINK.
+        # The index and file cache are keyed on it, so they are checked
+        # before the file is opened.
+        result, keys = self._file_lookup(filename, st)
+        if result is None:
+            result = self._identify_file(filename, st)
+            self._file_store(st, keys, result)
+        return result
+
+    def _make_index_config(self):
+        # everything besides the file that decides the result
+        from magic.index import database_fingerprint
+
+        parts = [database_fingerprint(self._magic_file), str(self.flags)]
+        if self._uncompress is not None:
+            parts.append("uncompress=python")
+        parts.extend("%d=%d" % item for item in sorted(self._params.items()))
+        self._index_config = ":".join(parts)
+        return self._index_config
+
+    def _identify_file(self, filename, st):
+        if self._fast_path is not None and stat.S_ISREG(st.st_mode) and st.st_size:
+            # not open(), which the compat functions replace in this module
+            try:
+                fd = os.open(filename, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+                try:
+                    head = os.read(fd, self._fast_path.head_bytes)
+                finally:
+                    os.close(fd)
+            except OSError:
+                # let libmagic report it
+                pass
+            else:
+                return self._fast_result(head, lambda: self._file_result(filename, st))
+        return self._file_result(filename, st)
+
+    def _file_result(self, filename, st):
+        if self._uncompress is not None and stat.S_ISREG(st.st_mode) and st.st_size:
+            result = self._uncompressed_file(filename)
+            if result is not None:
+                return result
         with self.lock:
             try:
-                # if we're on python3, convert buf to bytes
-                # otherwise this string is passed as wchar*
-                # which is not what libmagic expects
-                # NEXTBREAK: only take bytes
-                if type(buf) == str and str != bytes:
-                    buf = buf.encode("utf-8", errors="replace")
-                return maybe_decode(magic_buffer(self.cookie, buf))
+                return self._decode(magic_file(self.cookie, filename))
             except MagicException as e:
                 return self._handle509Bug(e)
 
-    def from_file(self, filename):
-        # raise FileNotFoundException or IOError if the file does not exist
-        os.stat(filename, follow_symlinks=self.flags & MAGIC_SYMLINK)
-
+    def _file_cache_key(self, st):
+        # Only regular files and symlinks have an mtime that tracks
+        # their contents.
+        if not (stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode)):
+            return None
+        return (
+            st.st_dev,
+            st.st_ino,
+            st.st_size,
+            st.st_mtime_ns,
+            self.flags,
+            self._params_key,
+            self._uncompress is not None,
+        )
+
+    def _uncompressed(self, data):
+        # With uncompress="python", identify compressed `data` as
+        # MAGIC_COMPRESS would.  Returns None if it isn't compressed.
+        inner = self._uncompress.decompress(data, self._bytes_max or _DEFAULT_BYTES_MAX)
+        if inner is None:
+            return None
         with self.lock:
             try:
-                return maybe_decode(magic_file(self.cookie, filename))
+                raw = self._uncompress.combine(
+                    self.flags,
+                    magic_buffer(self.cookie, inner),
+                    lambda: magic_buffer(self.cookie, data),
+                )
             except MagicException as e:
                 return self._handle509Bug(e)
+        return self._decode(raw)
+
+    def _uncompressed_file(self, filename):
+        # not open(), which the compat functions replace in this module
+        try:
+            fd = os.open(filename, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+            try:
+                data = os.read(fd, self._uncompress.HEAD_BYTES)
+                if self._uncompress.match(data) is None:
+                    return None
+                limit = self._bytes_max or _DEFAULT_BYTES_MAX
+                data += os.read(fd, limit - len(data))
+            finally:
+                os.close(fd)
+        except OSError:
+            # let libmagic report it
+            return None
+        return self._uncompressed(data)
+
+    def file_cache_info(self):
+        """
+        Return a CacheInfo of from_file cache statistics, or None if the
+        cache is disabled.
+        """
+        if self._file_cache is None:
+            return None
+        return self._file_cache.info()
 
-    def from_descriptor(self, fd):
+    def invalidate_file_cache(self, filename=None):
+        """
+        Forget the cached result for `filename`, or every cached result if
+        `filename` is None.
+        """
+        if self._file_cache is None:
+            return
+        if filename is None:
+            self._file_cache.clear()
+            return
+        try:
+            st = os.stat(filename, follow_symlinks=self.flags & MAGIC_SYMLINK)
+        except OSError:
+            return
+        key = self._file_cache_key(st)
+        if key is not None:
+            self._file_cache.discard(key)
+
+    def from_descriptor(self, fd, **flags):
+        if flags:
+            return self._with_flags(flags).from_descriptor(fd)
+        if self._uncompress is not None:
+            # read the prefix here so it can be decompressed
+            with os.fdopen(os.dup(fd), "rb", buffering=0) as f:
+                return self.from_stream(f)
         with self.lock:
             try:
-                return maybe_decode(magic_descriptor(self.cookie, fd))
+                return self._decode(magic_descriptor(self.cookie, fd))
             except MagicException as e:
                 return self._handle509Bug(e)
 
+    def from_buffers(self, bufs, chunk_size=64, **flags):
+        """
+        Identify the contents of each buffer in the iterable `bufs`.
+
+        This is a generator that yields one result per input, in order.
+        Failures are yielded as MagicException instances instead of
+        being raised, so one bad input doesn't end the batch.  The lock is
+        taken once per `chunk_size` inputs rather than once per input.
+        """
+        if flags:
+            return self._with_flags(flags).from_buffers(bufs, chunk_size)
+        if self._uncompress is not None:
+            return self._batch(bufs, self._each_chunk(self.from_buffer), chunk_size)
+        return self._batch(bufs, self._buffer_chunk, chunk_size)
+
+    def from_files(self, filenames, chunk_size=64, **flags):
+        """
+        Identify each file in the iterable `filenames`.  See from_buffers;
+        files that can't be stat'd yield the OSError instead.
+        """
+        if flags:
+            return self._with_flags(flags).from_files(filenames, chunk_size)
+        if self._uncompress is not None:
+            return self._batch(filenames, self._each_chunk(self.from_file), chunk_size)
+        return self._batch(filenames, self._file_chunk, chunk_size)
+
+    def from_descriptors(self, fds, chunk_size=64, **flags):
+        """
+        Identify each file descriptor in the iterable `fds`.  See
+        from_buffers.
+        """
+        if flags:
+            return self._with_flags(flags).from_descriptors(fds, chunk_size)
+        if self._uncompress is not None:
+            return self._batch(fds, self._each_chunk(self.from_descriptor), chunk_size)
+        return self._batch(fds, self._descriptor_chunk, chunk_size)
+
+    def _batch(self, items, run_chunk, chunk_size):
+        it = iter(items)
+        while True:
+            chunk = list(islice(it, chunk_size))
+            if not chunk:
+                return
+            for result in run_chunk(chunk):
+                yield result
+
+    def _each_chunk(self, identify):
+        # one call per input, for when results can't come from a single
+        # libmagic call each, as with uncompress="python"
+        def run_chunk(chunk):
+            results = []
+            for item in chunk:
+                try:
+                    results.append(identify(item))
+                except (OSError, MagicException) as e:
+                    results.append(e)
+            return results
+
+        return run_chunk
+
+    def _batch_result(self, result):
+        if result is not None:
+            return self._decode(result)
+        # same as errorcheck_null followed by _handle509Bug, minus the raise
+        err = magic_error(self.cookie)
+        if err is None and (self.flags & MAGIC_MIME_TYPE):
+            return self._decode(_OCTET_STREAM)
+        return MagicException(err)
+
+    def _buffer_chunk(self, chunk):
+        bufs = [self._buffer_arg(buf) for buf in chunk]
+        cache = self._buffer_cache
+        results = [None] * len(bufs)
+        keys = [None] * len(bufs)
+        if cache is not None:
+            for i, buf in enumerate(bufs):
+                keys[i] = self._buffer_cache_key(buf)
+                if keys[i] is not None:
+                    results[i] = cache.get(keys[i])
+
+        # only the cache misses are passed to libmagic
+        todo = [i for i, result in enumerate(results) if result is None]
+        cookie = self.cookie
+        with self.lock:
+            for i in todo:
+                buf = bufs[i]
+                results[i] = self._batch_result(
+                    _magic_buffer_unchecked(cookie, buf, len(buf))
+                )
+
+        if cache is not None:
+            for i in todo:
+                if keys[i] is not None and not isinstance(results[i], Exception):
+                    cache.put(keys[i], results[i])
+        return results
+
+    def _file_chunk(self, chunk):
+        follow = self.flags & MAGIC_SYMLINK
+        results = [None] * len(chunk)
+        todo = []
+        for i, filename in enumerate(chunk):
+            try:
+                st = os.stat(filename, follow_symlinks=follow)
+            except OSError as e:
+                results[i] = e
+                continue
+            results[i], keys = self._file_lookup(filename, st)
+            if results[i] is None:
+                todo.append((i, coerce_filename(filename), st, keys))
+
+        cookie = self.cookie
+        with self.lock:
+            for i, filename, _, _ in todo:
+                results[i] = self._batch_result(_magic_file_unchecked(cookie, filename))
+
+        for i, _, st, keys in todo:
+            if not isinstance(results[i], Exception):
+                self._file_store(st, keys, results[i])
+        return results
+
+    def _file_lookup(self, filename, st):
+        # Return the index's or the file cache's result for filename, or
+        # None and the keys _file_store needs to remember a new one.
+        index = self._index
+        index_key = cache_key = None
+        if index is not None and (stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode)):
+            index_key = index.key(filename)
+            config = self._index_config or self._make_index_config()
+            result = index.lookup(index_key, config, st)
+            if result is not None:
+                return result, None
+
+        cache = self._file_cache
+        if cache is not None:
+            cache_key = self._file_cache_key(st)
+            if cache_key is not None:
+                result = cache.get(cache_key)
+                if result is not None:
+                    if index_key is not None:
+                        index.store(index_key, self._index_config, st, result)
+                    return result, None
+        return None, (index_key, cache_key)
+
+    def _file_store(self, st, keys, result):
+        index_key, cache_key = keys
+        if cache_key is not None:
+            self._file_cache.put(cache_key, result)
+        if index_key is not None:
+            self._index.store(index_key, self._index_config, st, result)
+
+    def _descriptor_chunk(self, chunk):
+        cookie = self.cookie
+        with self.lock:
+            return [
+                self._batch_result(_magic_descriptor_unchecked(cookie, fd))
+                for fd in chunk
+            ]
+
+    def detect(self, source, fields=("mime_type", "encoding", "name"), **flags):
+        """
+        Identify `source` once for each of the requested `fields` and
+        return a Detection.
+
+        fields - any of "mime_type", "encoding", "name" (the textual
+            description) and "extension"
+
+        `source` may be a filename (str or os.PathLike), a file
+        descriptor, a binary file-like object or a buffer.  bytes are
+        treated as a buffer, not a filename.
+
+        Files are opened once and every lookup shares the descriptor.
+        Streams and buffers are read once and every lookup shares the
+        same in-memory prefix.  Only the cookies needed for `fields` are
+        used: the mime type and encoding come from a single lookup.
+        Other flags given to the constructor apply to every field.
+        """
+        if flags:
+            return self._with_flags(flags).detect(source, fields)
+        if isinstance(source, int):
+            return self._detect_descriptor(source, fields)
+        if isinstance(source, str) or hasattr(source, "__fspath__"):
+            return self._detect_file(source, fields)
+        if hasattr(source, "read"):
+            with self._stream_prefix(source) as view:
+                return self._detect_buffer(view, fields)
+        return self._detect_buffer(source, fields)
+
+    def _detect_file(self, filename, fields):
+        st = os.stat(filename, follow_symlinks=self.flags & MAGIC_SYMLINK)
+        if not stat.S_ISREG(st.st_mode):
+            # unfollowed symlinks, devices etc are described by libmagic
+            # without reading them
+            return self._detect(fields, lambda cookie: magic_file(cookie, filename))
+
+        fd = os.open(filename, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            return self._detect_descriptor(fd, fields)
+        finally:
+            os.close(fd)
+
+    def _detect_descriptor(self, fd, fields):
+        pos = None
+        if self._uncompress is None:
+            try:
+                pos = os.lseek(fd, 0, os.SEEK_CUR)
+            except OSError:
+                pass
+        if pos is None:
+            # pipes etc can only be read once, and decompressing needs
+            # the prefix in memory anyway
+            with os.fdopen(os.dup(fd), "rb", buffering=0) as f:
+                with self._stream_prefix(f) as view:
+                    return self._detect_buffer(view, fields)
+
+        def call(cookie):
+            os.lseek(fd, pos, os.SEEK_SET)
+            return magic_descriptor(cookie, fd)
+
+        try:
+            return self._detect(fields, call)
+        finally:
+            os.lseek(fd, pos, os.SEEK_SET)
+
+    def _detect_buffer(self, buf, fields):
+        buf = self._buffer_arg(buf)
+        if self._uncompress is not None:
+            inner = self._uncompress.decompress(
+                buf, self._bytes_max or _DEFAULT_BYTES_MAX
+            )
+            if inner is not None:
+                return self._detect(
+                    fields,
+                    lambda cookie: magic_buffer(cookie, inner),
+                    lambda cookie: magic_buffer(cookie, buf),
+                )
+        return self._detect(fields, lambda cookie: magic_buffer(cookie, buf))
+
+    def _detect(self, fields, call, outer=None):
+        # `outer`, if given, identifies the compressed data that `call`
+        # identifies the decompressed contents of
+        base = self.flags & ~(MAGIC_MIME_TYPE | MAGIC_MIME_ENCODING | MAGIC_EXTENSION)
+        plan = []
+        for field in fields:
+            if field not in Detection.__slots__:
+                raise ValueError("unknown field " + repr(field))
+        if "mime_type" in fields and "encoding" in fields:
+            plan.append((base | MAGIC_MIME_TYPE | MAGIC_MIME_ENCODING, None))
+        elif "mime_type" in fields:
+            plan.append((base | MAGIC_MIME_TYPE, "mime_type"))
+        elif "encoding" in fields:
+            plan.append((base | MAGIC_MIME_ENCODING, "encoding"))
+        if "name" in fields:
+            plan.append((base, "name"))
+        if "extension" in fields:
+            plan.append((base | MAGIC_EXTENSION, "extension"))
+
+        result = Detection()
+        with self.lock:
+            for flags, field in plan:
+                cookie = self._cookie_for(flags)
+                try:
+                    value = call(cookie)
+                except MagicException as e:
+                    if e.message is None and flags & MAGIC_MIME_TYPE:
+                        value = _OCTET_STREAM
+                    else:
+                        raise
+                if outer is not None and field in ("name", "extension"):
+                    value = self._uncompress.combine(
+                        flags, value, lambda: outer(cookie)
+                    )
+                if field is None:
+                    mime_type, _, encoding = value.partition(b"; ")
+                    result.mime_type = self._decode(mime_type)
+                    result.encoding = self._decode(encoding.replace(b"charset=", b""))
+                else:
+                    setattr(result, field, self._decode(value))
+        return result
+
+    def _cookie_for(self, flags):
+        # must be called with self.lock held
+        if flags == self.flags:
+            return self.cookie
+        cookie = self._detect_cookies.get(flags)
+        if cookie is None:
+            if flags & MAGIC_EXTENSION and (not _has_version or version() < 524):
+                raise NotImplementedError(
+                    "MAGIC_EXTENSION is not supported in this version of libmagic"
+                )
+            cookie = magic_open(flags)
+            try:
+                self._load_database(cookie)
+                for param, val in self._params.items():
+                    magic_setparam(cookie, param, val)
+            except BaseException:
+                magic_close(cookie)
+                raise
+            self._detect_cookies[flags] = cookie
+        return cookie
+
+    def _with_flags(self, overrides):
+        # Return a Magic like this one but for the flag arguments in
+        # `overrides`.  It shares this instance's cookie, lock, caches
+        # and database, and switches the cookie's flags while it holds
+        # the lock.  Views are kept, so each combination is built once.
+        flags = self.flags
+        python = self._uncompress is not None
+        for name, value in overrides.items():
+            if name == "uncompress":
+                python = value == "python"
+                value = value and not python
+            bit = _FLAG_ARGS.get(name)
+            if bit is not None:
+                flags = flags | bit if value else flags & ~bit
+                continue
+            bit = _CHECK_ARGS.get(name)
+            if bit is None:
+                raise TypeError("unexpected keyword argument %r" % name)
+            flags = flags & ~bit if value else flags | bit
+
+        if flags == self.flags and python == (self._uncompress is not None):
+            return self
+        view = self._views.get((flags, python))
+        if view is None:
+            if flags & MAGIC_EXTENSION and (not _has_version or version() < 524):
+                raise NotImplementedError(
+                    "MAGIC_EXTENSION is not supported in this version of libmagic"
+                )
+            cls = _FlagsView
+            if type(self) is not Magic:
+                # keep the methods of subclasses, including instrumentation
+                cls = type(cls.__name__, (cls, type(self)), {})
+            view = self._views.setdefault((flags, python), cls(self, flags, python))
+        return view
+
+    def _init_fast_path(self, verify_every):
+        from magic.fastpath import FastPath
+
+        # Signatures are calibrated against the instance's cookie, which
+        # is only safe when the answer depends on the leading bytes alone.
+        unsupported = (
+            MAGIC_MIME_ENCODING | MAGIC_COMPRESS | MAGIC_CONTINUE | MAGIC_EXTENSION
+        )
+        if (
+            not self.flags & MAGIC_MIME_TYPE
+            or self.flags & unsupported
+            or self._uncompress is not None
+        ):
+            raise ValueError(
+                "fast_path needs mime=True without mime_encoding, uncompress, "
+                "keep_going or extension"
+            )
+
+        def identify(sample):
+            try:
+                return magic_buffer(self.cookie, sample)
+            except MagicException as e:
+                if e.message is None:
+                    return None
+                raise
+
+        self._fast_path = FastPath(identify, self._decode, verify_every)
+
+    def _fast_result(self, head, compute):
+        fast = self._fast_path
+        sig = fast.lookup(head)
+        if sig is None:
+            return compute()
+        if not fast.sampled(sig):
+            return sig.result
+        result = compute()
+        fast.check(sig, result)
+        return result
+
+    def _make_decoder(self, result_type, intern_results):
+        # Every result passes through the function returned here, so the
+        # default is plain maybe_decode with nothing in between.
+        if result_type not in ("str", "bytes", "id"):
+            raise ValueError("unknown result_type " + repr(result_type))
+
+        if result_type == "id":
+            return _ResultIds()
+
+        convert = maybe_decode if result_type == "str" else bytes
+        if not intern_results:
+            return convert
+
+        interned = {}
+
+        def decode(raw):
+            result = interned.get(raw)
+            if result is None:
+                result = interned.setdefault(raw, convert(raw))
+            return result
+
+        return decode
+
+    def result_names(self):
+        """
+        With result_type="id", return a list of result strings indexed by
+        id.  Otherwise return None.
+        """
+        if not isinstance(self._decode, _ResultIds):
+            return None
+        return list(self._decode.names)
+
+    def _load_database(self, cookie):
+        if self._database is not None:
+            self._database.load(cookie)
+        else:
+            magic_load(cookie, self._magic_file)
+
     def _handle509Bug(self, e):
         # libmagic 5.09 has a bug where it might fail to identify the
         # mimetype of a file and returns null from magic_file (and
         # likely _buffer), but also does not return an error message.
         if e.message is None and (self.flags & MAGIC_MIME_TYPE):
-            return "application/octet-stream"
+            return self._decode(_OCTET_STREAM)
         else:
             raise e
 
     def setparam(self, param, val):
-        return magic_setparam(self.cookie, param, val)
+        result = magic_setparam(self.cookie, param, val)
+        for cookie in self._detect_cookies.values():
+            magic_setparam(cookie, param, val)
+        self._params[param] = val
+        self._params_key = tuple(sorted(self._params.items()))
+        self._index_config = None
+        self._views = {}
+        if param == MAGIC_PARAM_BYTES_MAX:
+            self._bytes_max = val
+        return result
 
     def getparam(self, param):
         return magic_getparam(self.cookie, param)
 
+    def __reduce__(self):
+        # Pickled as its constructor arguments and params.  A process
+        # unpickling the same instance many times, like a pool worker
+        # receiving it with every task, only builds it once.
+        if getattr(self, "_pickle_key", None) is None:
+            self._pickle_key = (os.getpid(), next(_pickle_keys))
+        return _rebuild, (self._pickle_key, self._args, self._params)
+
+    def _after_fork(self):
+        # Runs in a child process.  Threads that held locks in the parent
+        # don't exist here, so every lock is replaced.  If a call was in
+        # progress the cookies may be half-updated, so they are
+        # replaced too (and leaked, since closing them isn't safe either).
+        busy = self.lock.locked()
+        if hasattr(self.lock, "_lock"):
+            # a magic.stats._TimedLock
+            self.lock._lock = threading.Lock()
+        else:
+            self.lock = threading.Lock()
+        self._stream_lock = threading.Lock()
+        # views hold the old lock and perhaps the old cookie
+        self._views = {}
+        for obj in (self._file_cache, self._buffer_cache, self._stats, self._fast_path):
+            if obj is not None:
+                obj._lock = threading.Lock()
+        if isinstance(self._decode, _ResultIds):
+            self._decode._lock = threading.Lock()
+
+        if busy and self.cookie:
+            cookie = magic_open(self.flags)
+            self._load_database(cookie)
+            for param, val in self._params.items():
+                magic_setparam(cookie, param, val)
+            self.cookie = cookie
+            self._detect_cookies = {}
+
     def __del__(self):
         # no _thread_check here because there can be no other
         # references to this object at this point.
@@ -192,56 +1153,407 @@ class Magic:
         if hasattr(self, "cookie") and self.cookie and magic_close:
             magic_close(self.cookie)
             self.cookie = None
+        if getattr(self, "_detect_cookies", None) and magic_close:
+            for cookie in self._detect_cookies.values():
+                magic_close(cookie)
+            self._detect_cookies = {}
 
 
-_instances = {}
+class _FlagsLock:
+    """
+    Holds another Magic's lock with its cookie switched to `flags`, and
+    switches it back to `restore` before letting go.
+    """
+
+    def __init__(self, lock, cookie, flags, restore):
+        self._lock = lock
+        self._cookie = cookie
+        self._flags = flags
+        self._restore = restore
+
+    def acquire(self, blocking=True, timeout=-1):
+        if not self._lock.acquire(blocking, timeout):
+            return False
+        magic_setflags(self._cookie, self._flags)
+        return True
+
+    def release(self):
+        magic_setflags(self._cookie, self._restore)
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
 
+    __enter__ = acquire
 
-def _get_magic_type(mime):
-    i = _instances.get(mime)
+    def __exit__(self, *exc):
+        self.release()
+
+
+class _FlagsView(Magic):
+    """
+    A Magic running with other flags on another instance's cookie.  See
+    Magic._with_flags.
+    """
+
+    def __init__(self, base, flags, python_uncompress):
+        self.__dict__.update(base.__dict__)
+        self.flags = flags
+        self.lock = _FlagsLock(base.lock, base.cookie, flags, base.flags)
+        # these depend on the flags; the caches' keys include them
+        self._fast_path = None
+        self._index_config = None
+        self._views = {}
+        self._uncompress = None
+        if python_uncompress:
+            from magic import uncompress
+
+            self._uncompress = uncompress
+
+    def __reduce__(self):
+        raise TypeError("flag views can't be pickled, pickle the Magic instead")
+
+    def __del__(self):
+        # the cookies belong to the instance this is a view of
+        pass
+
+
+class MagicPool:
+    """
+    A bounded pool of Magic instances that share the same configuration.
+
+    A single Magic serializes every call on its lock.  A pool instead
+    hands each call its own cookie, so concurrent threads can run inside
+    libmagic at the same time (ctypes releases the GIL for the duration
+    of the call).  Cookies are created on demand, up to `size` of them;
+    once that many are busy further callers wait for one to be returned.
+    """
+
+    def __init__(self, size=None, max_uses=None, **kwargs):
+        """
+        Create a new pool.
+
+        size - maximum number of cookies, defaults to the number of CPUs plus 4
+        max_uses - close and replace a cookie after this many calls
+        kwargs - passed through to Magic() when creating a cookie
+        """
+        if size is None:
+            size = min(32, (os.cpu_count() or 1) + 4)
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.size = size
+        self.max_uses = max_uses
+        self.kwargs = kwargs
+
+        # Idle entries are [magic, uses] pairs.  deque.append and
+        # deque.pop are atomic, so the common path takes no lock; the
+        # condition is only used to grow the pool or wait for an entry.
+        self._idle = deque()
+        self._created = 0
+        self._waiters = 0
+        self._cond = threading.Condition(threading.Lock())
+        _live_pools.add(self)
+
+    def _acquire(self):
+        try:
+            return self._idle.pop()
+        except IndexError:
+            pass
+
+        with self._cond:
+            self._waiters += 1
+            try:
+                while True:
+                    try:
+                        return self._idle.pop()
+                    except IndexError:
+                        pass
+                    if self._created < self.size:
+                        self._created += 1
+                        break
+                    self._cond.wait()
+            finally:
+                self._waiters -= 1
+
+        try:
+            return [Magic(**self.kwargs), 0]
+        except BaseException:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, entry):
+        entry[1] += 1
+        if self.max_uses is not None and entry[1] >= self.max_uses:
+            # drop the entry, Magic.__del__ closes the cookie and the
+            # next caller that finds the pool empty will build a new one
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            return
+
+        self._idle.append(entry)
+        if self._waiters:
+            with self._cond:
+                self._cond.notify()
+
+    def warm(self, count=1):
+        """
+        Create cookies until `count` of them exist, or the pool is full, so
+        that later calls don't pay for loading the database.
+        """
+        entries = []
+        try:
+            while self._created < min(count, self.size):
+                with self._cond:
+                    if self._created >= min(count, self.size):
+                        break
+                    self._created += 1
+                try:
+                    entries.append([Magic(**self.kwargs), 0])
+                except BaseException:
+                    with self._cond:
+                        self._created -= 1
+                        self._cond.notify()
+                    raise
+        finally:
+            for entry in entries:
+                self._idle.append(entry)
+            if entries:
+                with self._cond:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Borrow a Magic instance for the duration of a `with` block.
+        """
+        entry = self._acquire()
+        try:
+            yield entry[0]
+        finally:
+            self._release(entry)
+
+    def from_buffer(self, buf, **flags):
+        with self.acquire() as m:
+            return m.from_buffer(buf, **flags)
+
+    def from_file(self, filename, **flags):
+        with self.acquire() as m:
+            return m.from_file(filename, **flags)
+
+    def from_stream(self, fobj, **flags):
+        with self.acquire() as m:
+            return m.from_stream(fobj, **flags)
+
+    def from_descriptor(self, fd, **flags):
+        with self.acquire() as m:
+            return m.from_descriptor(fd, **flags)
+
+    def from_archive(self, source, max_depth=1, **flags):
+        with self.acquire() as m:
+            for item in m.from_archive(source, max_depth, **flags):
+                yield item
+
+    def detect(self, source, fields=("mime_type", "encoding", "name"), **flags):
+        with self.acquire() as m:
+            return m.detect(source, fields, **flags)
+
+    def from_buffers(self, bufs, chunk_size=64, **flags):
+        with self.acquire() as m:
+            for result in m.from_buffers(bufs, chunk_size, **flags):
+                yield result
+
+    def from_files(self, filenames, chunk_size=64, **flags):
+        with self.acquire() as m:
+            for result in m.from_files(filenames, chunk_size, **flags):
+                yield result
+
+    def from_descriptors(self, fds, chunk_size=64, **flags):
+        with self.acquire() as m:
+            for result in m.from_descriptors(fds, chunk_size, **flags):
+                yield result
+
+    def _after_fork(self):
+        # Runs in a child process.  Entries borrowed by threads that
+        # didn't survive the fork will never come back.
+        self._cond = threading.Condition(threading.Lock())
+        self._waiters = 0
+        self._created = len(self._idle)
+
+    def close(self):
+        """
+        Close all idle cookies.  Cookies that are currently borrowed are
+        closed when they are returned and garbage collected.
+        """
+        while True:
+            try:
+                self._idle.pop()
+            except IndexError:
+                break
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+
+
+_instances = {}
+
+# every instance, so locks can be reset in a forked child
+_live_magic = weakref.WeakSet()
+_live_pools = weakref.WeakSet()
+
+# pickled Magic instances already rebuilt in this process.  Only the
+# most recent few are kept, so a process sent many different instances
+# doesn't keep every cookie open.
+_REBUILT_MAX = 8
+_rebuilt = _LRUCache(_REBUILT_MAX)
+_rebuilt_lock = threading.Lock()
+_pickle_keys = count()
+
+
+def _rebuild(key, args, params):
+    m = _rebuilt.get(key)
+    if m is not None:
+        return m
+    with _rebuilt_lock:
+        m = _rebuilt.get(key)
+        if m is None:
+            m = Magic(**args)
+            for param, val in params.items():
+                m.setparam(param, val)
+            if key[0] != os.getpid():
+                # a copy in the process that pickled it, e.g. from
+                # copy.deepcopy, should be a separate instance every time
+                _rebuilt.put(key, m)
+    return m
+
+
+def _after_fork_in_child():
+    global _instances, _rebuilt_lock
+
+    # the module-level pools are rebuilt on demand
+    _instances = {}
+    _rebuilt_lock = threading.Lock()
+    _rebuilt._lock = threading.Lock()
+    loader._lib_lock = threading.Lock()
+    database = sys.modules.get("magic.database")
+    if database is not None:
+        database.SharedDatabase._instances_lock = threading.Lock()
+    index = sys.modules.get("magic.index")
+    if index is not None:
+        index.Index._instances_lock = threading.Lock()
+    for m in list(_live_magic):
+        m._after_fork()
+    for pool in list(_live_pools):
+        pool._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _get_magic_type(mime=False):
+    # One pool serves every combination of flags, switching them per
+    # call, so there is only one set of cookies and database copies.
+    # `mime` is kept for callers of the old per-mime pools.
+    i = _instances.get(None)
     if i is None:
-        i = _instances[mime] = Magic(mime=mime)
+        kwargs = {}
+        database = _default_database()
+        if database is not None:
+            kwargs["shared_database"] = database
+        i = _instances.setdefault(None, MagicPool(**kwargs))
     return i
 
 
-def from_file(filename, mime=False):
+def _default_database():
+    # The module-level instances share the default database when that
+    # needs no extra work, and otherwise load it as usual.
+    if not _has_load_buffers or not _has_getpath:
+        return None
+    from magic.database import SharedDatabase
+
+    try:
+        return SharedDatabase.get(None, compile=False)
+    except (OSError, ValueError, MagicException):
+        return None
+
+
+def warmup(mime=(False, True), count=1, pools=(), block=False):
+    """
+    Load the database ahead of time so the first call doesn't wait for it.
+
+    mime - which module-level instances to create, by their mime
+        argument.  They are now all the same pool.
+    count - number of cookies to create in each pool
+    pools - other MagicPool instances to warm as well
+    block - if False the work is done on a daemon thread, which is
+        started and returned.  Errors are re-raised by the next call that
+        needs the failed cookie rather than here.
+    """
+
+    def run():
+        for m in mime:
+            _get_magic_type(m).warm(count)
+        for pool in pools:
+            pool.warm(count)
+
+    if block:
+        run()
+        return None
+
+    def background():
+        try:
+            run()
+        except Exception:
+            pass
+
+    thread = threading.Thread(target=background, name="magic-warmup")
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def from_file(filename, mime=False, **flags):
     """
     Accepts a filename and returns the detected filetype.  Return
     value is the mimetype if mime=True, otherwise a human readable
-    name.
+    name.  Any other Magic() flag argument can be given too, e.g.
+    mime_encoding=True or uncompress=True.
 
     >>> magic.from_file("testdata/test.pdf", mime=True)
     'application/pdf'
     """
-    m = _get_magic_type(mime)
-    return m.from_file(filename)
+    m = _get_magic_type()
+    return m.from_file(filename, mime=mime, **flags)
 
 
-def from_buffer(buffer, mime=False):
+def from_buffer(buffer, mime=False, **flags):
     """
     Accepts a binary string and returns the detected filetype.  Return
     value is the mimetype if mime=True, otherwise a human readable
-    name.
+    name.  Other flags are as for from_file.
 
     >>> magic.from_buffer(open("testdata/test.pdf").read(1024))
     'PDF document, version 1.2'
     """
-    m = _get_magic_type(mime)
-    return m.from_buffer(buffer)
+    m = _get_magic_type()
+    return m.from_buffer(buffer, mime=mime, **flags)
 
 
-def from_descriptor(fd, mime=False):
+def from_descriptor(fd, mime=False, **flags):
     """
     Accepts a file descriptor and returns the detected filetype.  Return
     value is the mimetype if mime=True, otherwise a human readable
-    name.
+    name.  Other flags are as for from_file.
 
     >>> f = open("testdata/test.pdf")
     >>> magic.from_descriptor(f.fileno())
     'PDF document, version 1.2'
     """
-    m = _get_magic_type(mime)
-    return m.from_descriptor(fd)
+    m = _get_magic_type()
+    return m.from_descriptor(fd, mime=mime, **flags)
 
 
 from . import loader
@@ -345,7 +1657,70 @@ _magic_buffer.argtypes = [magic_t, c_void_p, c_size_t]
 _magic_buffer.errcheck = errorcheck_null
 
 
+def _buffer_view(buf, limit=None):
+    """
+    Return the first `limit` bytes of `buf` (all of it if `limit` is
+    None) as bytes or a ctypes array that can be passed to libmagic.
+
+    bytes and writable buffers (bytearray, mmap, writable memoryviews and
+    arrays) are not copied.  Other read-only buffers are copied, but no
+    more than `limit` bytes of them.
+    """
+    if type(buf) is bytes:
+        if limit is None or len(buf) <= limit:
+            return buf
+        # a view of the first `limit` bytes, which keeps a reference to
+        # buf since the caller may not (e.g. a str encoded for the call)
+        address = cast(c_char_p(buf), c_void_p).value
+        view = (c_char * limit).from_address(address)
+        view._source = buf
+        return view
+
+    if isinstance(buf, Array):
+        return buf
+
+    view = memoryview(buf)
+    if not view.c_contiguous:
+        # ctypes needs contiguous memory, so copy, but only as many
+        # leading items as cover the first `limit` bytes
+        if limit is not None and view.ndim and view.nbytes > limit:
+            item_bytes = view.nbytes // view.shape[0]
+            view = view[: -(-limit // item_bytes)]
+        data = view.tobytes()
+        return data if limit is None else data[:limit]
+    if view.ndim != 1 or view.itemsize != 1:
+        view = view.cast("B")
+    n = view.nbytes
+    if limit is not None and n > limit:
+        n = limit
+    if view.readonly:
+        return view[:n].tobytes()
+    return (c_char * n).from_buffer(view)
+
+
+def _read_prefix(fobj, view):
+    """
+    Fill `view` from `fobj` until it is full or the stream ends, and
+    return the number of bytes read.
+    """
+    readinto = getattr(fobj, "readinto", None)
+    n = 0
+    size = len(view)
+    while n < size:
+        if readinto is not None:
+            got = readinto(view[n:])
+        else:
+            data = fobj.read(size - n)
+            got = len(data) if data else 0
+            view[n : n + got] = data
+        if not got:
+            break
+        n += got
+    return n
+
+
 def magic_buffer(cookie, buf):
+    buf = _buffer_view(buf)
     return _magic_buffer(cookie, buf, len(buf))
 
 
@@ -364,6 +1739,22 @@ def magic_descriptor(cookie, fd):
     return _magic_descriptor(cookie, fd)
 
 
+# Unchecked prototypes for the batch APIs, which report errors per item
+# instead of raising.  Indexing the library returns a fresh function
+# object, so this doesn't disturb the errcheck set on the ones above.
+_magic_file_unchecked = libmagic["magic_file"]
+_magic_file_unchecked.restype = c_char_p
+_magic_file_unchecked.argtypes = [magic_t, c_char_p]
+
+_magic_buffer_unchecked = libmagic["magic_buffer"]
+_magic_buffer_unchecked.restype = c_char_p
+_magic_buffer_unchecked.argtypes = [magic_t, c_void_p, c_size_t]
+
+_magic_descriptor_unchecked = libmagic["magic_descriptor"]
+_magic_descriptor_unchecked.restype = c_char_p
+_magic_descriptor_unchecked.argtypes = [magic_t, c_int]
+
+
 _magic_load = libmagic.magic_load
 _magic_load.restype = c_int
 _magic_load.argtypes = [magic_t, c_char_p]
@@ -415,6 +1806,38 @@ def magic_getparam(cookie, param):
     return val.value
 
 
+_has_load_buffers = False
+if hasattr(libmagic, "magic_load_buffers"):
+    _has_load_buffers = True
+    _magic_load_buffers = libmagic.magic_load_buffers
+    _magic_load_buffers.restype = c_int
+    _magic_load_buffers.argtypes = [
+        magic_t,
+        POINTER(c_void_p),
+        POINTER(c_size_t),
+        c_size_t,
+    ]
+    _magic_load_buffers.errcheck = errorcheck_negative_one
+
+
+def magic_load_buffers(cookie, buffers, sizes, nbuffers):
+    """
+    Load compiled databases from memory.  `buffers` and `sizes` are
+    ctypes arrays of pointers and lengths.  libmagic uses the memory in
+    place, so it must outlive the cookie.
+    """
+    if not _has_load_buffers:
+        raise NotImplementedError("magic_load_buffers not implemented")
+    return _magic_load_buffers(cookie, buffers, sizes, nbuffers)
+
+
+_has_getpath = False
+if hasattr(libmagic, "magic_getpath"):
+    _has_getpath = True
+    magic_getpath = libmagic.magic_getpath
+    magic_getpath.restype = c_char_p
+    magic_getpath.argtypes = [c_char_p, c_int]
+
 _has_version = False
 if hasattr(libmagic, "magic_version"):
     _has_version = True
@@ -471,6 +1894,52 @@ MAGIC_PARAM_ELF_NOTES_MAX = 4  # # Max ELF sections processed
 MAGIC_PARAM_REGEX_MAX = 5  # Length limit for regex searches
 MAGIC_PARAM_BYTES_MAX = 6  # Max number of bytes to read from file
 
+# libmagic's read size before MAGIC_PARAM_BYTES_MAX was configurable
+_DEFAULT_BYTES_MAX = 1024 * 1024
+
+# what the mime type is reported as when libmagic fails without an error
+_OCTET_STREAM = b"application/octet-stream"
+
+# Magic() flag arguments that can be overridden per call, and their flags
+_FLAG_ARGS = {
+    "mime": MAGIC_MIME_TYPE,
+    "mime_encoding": MAGIC_MIME_ENCODING,
+    "keep_going": MAGIC_CONTINUE,
+    "uncompress": MAGIC_COMPRESS,
+    "raw": MAGIC_RAW,
+    "extension": MAGIC_EXTENSION,
+    "follow_symlinks": MAGIC_SYMLINK,
+}
+# and those that set a flag when false
+_CHECK_ARGS = {
+    "check_tar": MAGIC_NO_CHECK_TAR,
+    "check_soft": MAGIC_NO_CHECK_SOFT,
+    "check_apptype": MAGIC_NO_CHECK_APPTYPE,
+    "check_elf": MAGIC_NO_CHECK_ELF,
+    "check_text": MAGIC_NO_CHECK_TEXT,
+    "check_cdf": MAGIC_NO_CHECK_CDF,
+    "check_csv": MAGIC_NO_CHECK_CSV,
+    "check_encoding": MAGIC_NO_CHECK_ENCODING,
+    "check_json": MAGIC_NO_CHECK_JSON,
+    "check_simh": MAGIC_NO_CHECK_SIMH,
+}
+
+
+# Helpers that live in their own modules are imported on first use to
+# keep `import magic` cheap.
+_LAZY_ATTRS = {
+    "identify_many": "magic.parallel",
+    "prefetch_files": "magic.prefetch",
+    "scan_tree": "magic.scan",
+}
+
+_COMPAT_FUNCTIONS = (
+    "detect_from_filename",
+    "detect_from_content",
+    "detect_from_fobj",
+    "open",
+)
+
 
 # This package name conflicts with the one provided by upstream
 # libmagic.  This is a common source of confusion for users.  To
@@ -492,8 +1961,7 @@ def _add_compat(to_module):
 
         return _
 
-    fn = ["detect_from_filename", "detect_from_content", "detect_from_fobj", "open"]
-    for fname in fn:
+    for fname in _COMPAT_FUNCTIONS:
         to_module[fname] = deprecation_wrapper(compat.__dict__[fname])
 
     # copy constants over, ensuring there's no conflicts
@@ -512,4 +1980,33 @@ def _add_compat(to_module):
                 to_module[name] = value
 
 
-_add_compat(globals())
+_compat_added = False
+
+
+def __getattr__(name):
+    global _compat_added
+
+    module = _LAZY_ATTRS.get(name)
+    if module is not None:
+        import importlib
+
+        value = globals()[name] = getattr(importlib.import_module(module), name)
+        return value
+
+    # compat functions and constants are added the first time one of
+    # them is used
+    if not _compat_added and (name in _COMPAT_FUNCTIONS or name.isupper()):
+        _add_compat(globals())
+        _compat_added = True
+        if name in globals():
+            return globals()[name]
+
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+# module __getattr__ needs python 3.7
+if sys.version_info < (3, 7):
+    for _name in _LAZY_ATTRS:
+        __getattr__(_name)
+    _add_compat(globals())
+    _compat_added = True
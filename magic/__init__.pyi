@@ -1,12 +1,47 @@
 import ctypes.util
 import threading
-from typing import Any, Text, Optional, Union
+from typing import (
+    Any,
+    BinaryIO,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Text,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 from os import PathLike
 
+_Buffer = Union[bytes, bytearray, memoryview, str]
+
 class MagicException(Exception):
     message: Any = ...
     def __init__(self, message: Any) -> None: ...
 
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+class Detection:
+    mime_type: Optional[Text]
+    encoding: Optional[Text]
+    name: Optional[Text]
+    extension: Optional[Text]
+    def __init__(
+        self,
+        mime_type: Optional[Text] = ...,
+        encoding: Optional[Text] = ...,
+        name: Optional[Text] = ...,
+        extension: Optional[Text] = ...,
+    ) -> None: ...
+
 class Magic:
     flags: int = ...
     cookie: Any = ...
@@ -17,7 +52,7 @@ class Magic:
         magic_file: Optional[Any] = ...,
         mime_encoding: bool = ...,
         keep_going: bool = ...,
-        uncompress: bool = ...,
+        uncompress: Union[bool, str] = ...,
         raw: bool = ...,
         extension: bool = ...,
         follow_symlinks: bool = ...,
@@ -29,17 +64,136 @@ class Magic:
         check_encoding: bool = ...,
         check_json: bool = ...,
         check_simh: bool = ...,
+        file_cache: Optional[int] = ...,
+        cache: Optional[int] = ...,
+        cache_safe: bool = ...,
+        compile_cache: Union[bool, str] = ...,
+        shared_database: Any = ...,
+        stats: bool = ...,
+        hooks: Optional[Iterable[Any]] = ...,
+        fast_path: bool = ...,
+        fast_path_verify: Optional[int] = ...,
+        result_type: str = ...,
+        intern_results: bool = ...,
+        index: Any = ...,
     ) -> None: ...
-    def from_buffer(self, buf: Union[bytes, str]) -> Text: ...
-    def from_file(self, filename: Union[bytes, str, PathLike]) -> Text: ...
-    def from_descriptor(self, fd: int, mime: bool = ...) -> Text: ...
+    def from_buffer(self, buf: _Buffer, **flags: Any) -> Text: ...
+    def from_stream(self, fobj: BinaryIO, **flags: Any) -> Text: ...
+    def from_file(
+        self, filename: Union[bytes, str, PathLike], **flags: Any
+    ) -> Text: ...
+    def from_descriptor(self, fd: int, **flags: Any) -> Text: ...
+    def from_archive(
+        self,
+        source: Union[str, bytes, PathLike, BinaryIO],
+        max_depth: int = ...,
+        **flags: Any,
+    ) -> Iterator[Tuple[Text, Any]]: ...
+    def detect(
+        self,
+        source: Union[int, str, PathLike, BinaryIO, _Buffer],
+        fields: Sequence[str] = ...,
+        **flags: Any,
+    ) -> Detection: ...
+    def from_buffers(
+        self, bufs: Iterable[_Buffer], chunk_size: int = ..., **flags: Any
+    ) -> Iterator[Union[Text, Exception]]: ...
+    def from_files(
+        self,
+        filenames: Iterable[Union[bytes, str, PathLike]],
+        chunk_size: int = ...,
+        **flags: Any,
+    ) -> Iterator[Union[Text, Exception]]: ...
+    def from_descriptors(
+        self, fds: Iterable[int], chunk_size: int = ..., **flags: Any
+    ) -> Iterator[Union[Text, Exception]]: ...
+    def cache_info(self) -> Optional[CacheInfo]: ...
+    def cache_clear(self) -> None: ...
+    def file_cache_info(self) -> Optional[CacheInfo]: ...
+    def invalidate_file_cache(
+        self, filename: Union[bytes, str, PathLike, None] = ...
+    ) -> None: ...
+    def stats(self, reset: bool = ...) -> Optional[Dict[str, Any]]: ...
+    def result_names(self) -> Optional[List[Text]]: ...
+    def __reduce__(self) -> Any: ...
     def setparam(self, param: Any, val: Any): ...
     def getparam(self, param: Any): ...
     def __del__(self) -> None: ...
 
-def from_file(filename: Union[bytes, str, PathLike], mime: bool = ...) -> Text: ...
-def from_buffer(buffer: Union[bytes, str], mime: bool = ...) -> Text: ...
-def from_descriptor(fd: int, mime: bool = ...) -> Text: ...
+class MagicPool:
+    size: int = ...
+    max_uses: Optional[int] = ...
+    kwargs: Dict[str, Any] = ...
+    def __init__(
+        self, size: Optional[int] = ..., max_uses: Optional[int] = ..., **kwargs: Any
+    ) -> None: ...
+    def warm(self, count: int = ...) -> None: ...
+    def acquire(self) -> ContextManager[Magic]: ...
+    def from_buffer(self, buf: _Buffer, **flags: Any) -> Text: ...
+    def from_stream(self, fobj: BinaryIO, **flags: Any) -> Text: ...
+    def from_file(
+        self, filename: Union[bytes, str, PathLike], **flags: Any
+    ) -> Text: ...
+    def from_descriptor(self, fd: int, **flags: Any) -> Text: ...
+    def from_archive(
+        self,
+        source: Union[str, bytes, PathLike, BinaryIO],
+        max_depth: int = ...,
+        **flags: Any,
+    ) -> Iterator[Tuple[Text, Any]]: ...
+    def detect(
+        self,
+        source: Union[int, str, PathLike, BinaryIO, _Buffer],
+        fields: Sequence[str] = ...,
+        **flags: Any,
+    ) -> Detection: ...
+    def from_buffers(
+        self, bufs: Iterable[_Buffer], chunk_size: int = ..., **flags: Any
+    ) -> Iterator[Union[Text, Exception]]: ...
+    def from_files(
+        self,
+        filenames: Iterable[Union[bytes, str, PathLike]],
+        chunk_size: int = ...,
+        **flags: Any,
+    ) -> Iterator[Union[Text, Exception]]: ...
+    def from_descriptors(
+        self, fds: Iterable[int], chunk_size: int = ..., **flags: Any
+    ) -> Iterator[Union[Text, Exception]]: ...
+    def close(self) -> None: ...
+
+def warmup(
+    mime: Iterable[bool] = ...,
+    count: int = ...,
+    pools: Iterable[MagicPool] = ...,
+    block: bool = ...,
+) -> Optional[threading.Thread]: ...
+def from_file(
+    filename: Union[bytes, str, PathLike], mime: bool = ..., **flags: Any
+) -> Text: ...
+def from_buffer(buffer: _Buffer, mime: bool = ..., **flags: Any) -> Text: ...
+def from_descriptor(fd: int, mime: bool = ..., **flags: Any) -> Text: ...
+def identify_many(
+    items: Iterable[Union[bytes, bytearray, str, PathLike]],
+    workers: Optional[int] = ...,
+    ordered: bool = ...,
+    chunksize: int = ...,
+    **kwargs: Any,
+) -> Iterator[Any]: ...
+def prefetch_files(
+    filenames: Iterable[Union[str, bytes, PathLike]],
+    io_depth: int = ...,
+    match_workers: Optional[int] = ...,
+    **kwargs: Any,
+) -> Iterator[Any]: ...
+def scan_tree(
+    root: Union[str, bytes, PathLike],
+    workers: Optional[int] = ...,
+    include: Optional[Iterable[str]] = ...,
+    exclude: Optional[Iterable[str]] = ...,
+    follow_symlinks: bool = ...,
+    per_device: Optional[int] = ...,
+    **kwargs: Any,
+) -> Iterator[Tuple[Any, Any]]: ...
 
 libmagic: Any
 dll: Any
@@ -62,11 +216,15 @@ def magic_file(cookie: Any, filename: Any): ...
 def magic_buffer(cookie: Any, buf: Any): ...
 def magic_descriptor(cookie: Any, fd: int): ...
 def magic_load(cookie: Any, filename: Any): ...
+def magic_load_buffers(cookie: Any, buffers: Any, sizes: Any, nbuffers: int): ...
 
+magic_getpath: Any
 magic_setflags: Any
 magic_check: Any
 magic_compile: Any
 
+_has_param: bool
+
 def magic_setparam(cookie: Any, param: Any, val: Any): ...
 def magic_getparam(cookie: Any, param: Any): ...
 
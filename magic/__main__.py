@@ -0,0 +1,188 @@
+"""
+Identify files from the command line.
+
+    python -m magic [options] [path ...]
+
+Paths are taken from the arguments, or read from standard input one per
+line (or NUL-separated with -0) when there are none or the only one is
+"-".  Files are identified on a pool of threads, each with its own
+cookie, and results are written as they finish: one JSON object per
+line by default, or tab-separated with --tsv.
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+import magic
+
+FIELDS = ("mime_type", "encoding", "name")
+
+
+def _read_paths(stream, sep):
+    """
+    Yield the `sep`-separated paths in the binary `stream` as they
+    arrive, decoded the way os.listdir would.
+    """
+    pending = b""
+    while True:
+        block = stream.read1(65536) if hasattr(stream, "read1") else stream.read(65536)
+        if not block:
+            break
+        parts = (pending + block).split(sep)
+        pending = parts.pop()
+        for part in parts:
+            if sep == b"\n" and part.endswith(b"\r"):
+                part = part[:-1]
+            if part:
+                yield os.fsdecode(part)
+    if pending.rstrip(b"\r"):
+        yield os.fsdecode(pending.rstrip(b"\r") if sep == b"\n" else pending)
+
+
+def _identify(pool, path):
+    try:
+        return pool.detect(path, FIELDS)
+    except (OSError, magic.MagicException) as e:
+        return e
+
+
+def _format_json(path, result):
+    if isinstance(result, Exception):
+        record = {"path": path, "error": str(result)}
+    else:
+        record = {
+            "path": path,
+            "mime_type": result.mime_type,
+            "encoding": result.encoding,
+            "description": result.name,
+        }
+    # json.dumps escapes everything outside ASCII, undecodable bytes in
+    # paths included
+    return json.dumps(record).encode("ascii") + b"\n"
+
+
+def _tsv_field(field):
+    # Paths are written as the bytes they were read as, since they
+    # needn't be text.  Tabs and newlines are escaped to keep one record
+    # per line whatever the path or description contains.
+    field = os.fsencode(field)
+    return field.replace(b"\\", b"\\\\").replace(b"\t", b"\\t").replace(b"\n", b"\\n")
+
+
+def _format_tsv(path, result):
+    if isinstance(result, Exception):
+        fields = [path, "", "", "error: " + str(result)]
+    else:
+        fields = [path, result.mime_type, result.encoding, result.name]
+    return b"\t".join(_tsv_field(f) for f in fields) + b"\n"
+
+
+def _results(pool, paths, jobs, keep_order):
+    """
+    Yield (path, result) pairs, keeping at most a few batches of work in
+    flight so huge path lists are never held in memory.
+    """
+    window = jobs * 4
+    with ThreadPoolExecutor(jobs) as executor:
+        if keep_order:
+            pending = deque()
+            for path in paths:
+                pending.append((path, executor.submit(_identify, pool, path)))
+                if len(pending) >= window:
+                    path, fut = pending.popleft()
+                    yield path, fut.result()
+            while pending:
+                path, fut = pending.popleft()
+                yield path, fut.result()
+            return
+
+        pending = {}
+        for path in paths:
+            pending[executor.submit(_identify, pool, path)] = path
+            if len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield pending.pop(fut), fut.result()
+        for fut in as_completed(list(pending)):
+            yield pending.pop(fut), fut.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m magic", description="Identify files with libmagic."
+    )
+    parser.add_argument("paths", nargs="*", help="files to identify, or - for stdin")
+    parser.add_argument(
+        "-0",
+        "--null",
+        action="store_true",
+        help="paths on standard input are separated by NUL, not newlines",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="number of worker threads (default: number of CPUs plus 4, at most 32)",
+    )
+    parser.add_argument(
+        "-k",
+        "--keep-order",
+        action="store_true",
+        help="write results in input order instead of as they finish",
+    )
+    parser.add_argument(
+        "--tsv",
+        action="store_true",
+        help="write path, mime type, encoding and description separated by tabs",
+    )
+    parser.add_argument(
+        "-L", "--follow-symlinks", action="store_true", help="follow symlinks"
+    )
+    parser.add_argument(
+        "-z", "--uncompress", action="store_true", help="look inside compressed files"
+    )
+    parser.add_argument("-m", "--magic-file", help="use this magic database")
+    args = parser.parse_args(argv)
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    if not args.paths or args.paths == ["-"]:
+        paths = _read_paths(sys.stdin.buffer, b"\0" if args.null else b"\n")
+    else:
+        paths = iter(args.paths)
+
+    pool = magic.MagicPool(
+        size=args.jobs,
+        magic_file=args.magic_file,
+        follow_symlinks=args.follow_symlinks,
+        uncompress=args.uncompress,
+    )
+    fmt = _format_tsv if args.tsv else _format_json
+    out = sys.stdout.buffer
+    status = 0
+    try:
+        for path, result in _results(pool, paths, pool.size, args.keep_order):
+            if isinstance(result, Exception):
+                status = 1
+            out.write(fmt(path, result))
+        out.flush()
+    except BrokenPipeError:
+        # e.g. piped into head; don't complain when stdout is closed
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, out.fileno())
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        pool.close()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+asyncio interface to python-magic.
+
+Calls into libmagic block, so awaiting them directly would stall the
+event loop.  AsyncMagic runs them on a dedicated thread pool, each
+thread borrowing a cookie from its own MagicPool, and bounds both the
+number of calls and the number of bytes in flight.
+
+>>> async with AsyncMagic(mime=True, max_concurrency=8) as m:
+...     await m.from_file("testdata/test.pdf", timeout=5)
+'application/pdf'
+"""
+
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from magic import MagicPool, MAGIC_PARAM_BYTES_MAX, MAGIC_SYMLINK, _has_param
+
+
+class AsyncMagic:
+    """
+    Awaitable wrapper around a MagicPool.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=None,
+        max_bytes=None,
+        timeout=None,
+        max_uses=None,
+        **kwargs,
+    ):
+        """
+        Create a new asyncio wrapper.
+
+        max_concurrency - number of calls that may run at once, and the
+            number of cookies and threads used to run them
+        max_bytes - limit on the bytes being examined at once.  A single
+            call larger than this is still allowed when nothing else is
+            in flight.
+        timeout - default timeout in seconds for each call
+        max_uses - passed through to MagicPool
+        kwargs - passed through to Magic()
+        """
+        self._pool = MagicPool(size=max_concurrency, max_uses=max_uses, **kwargs)
+        self.max_concurrency = self._pool.size
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            self.max_concurrency, thread_name_prefix="magic-aio"
+        )
+
+        # Read from a cookie on first use, on a worker thread: creating
+        # one loads the database, which would stall the event loop.
+        self._bytes_max = None
+        self._stat_file = None
+        self._config = None
+
+        # created on first use so they belong to the running loop
+        self._sem = None
+        self._in_flight = 0
+        self._byte_waiters = deque()
+
+    def _read_config(self):
+        with self._pool.acquire() as m:
+            if _has_param:
+                self._bytes_max = m.getparam(MAGIC_PARAM_BYTES_MAX)
+            # from_file sizes its call from the link itself unless
+            # libmagic follows it, so dangling links can be identified
+            self._stat_file = os.stat if m.flags & MAGIC_SYMLINK else os.lstat
+
+    async def _configure(self):
+        if self._stat_file is not None:
+            return
+        if self._config is None:
+            loop = asyncio.get_running_loop()
+            self._config = loop.run_in_executor(self._executor, self._read_config)
+        config = self._config
+        try:
+            # shared by every caller, so one giving up mustn't cancel it
+            await asyncio.shield(config)
+        except Exception:
+            # e.g. the database failed to load; the next call tries again
+            if self._config is config:
+                self._config = None
+            raise
+
+    def _stat_path(self, filename):
+        return self._stat_file(filename)
+
+    async def _reserve(self, nbytes):
+        # the call slot is already held; wait for room for nbytes
+        if self.max_bytes is None:
+            return
+        while self._in_flight and self._in_flight + nbytes > self.max_bytes:
+            waiter = asyncio.get_running_loop().create_future()
+            self._byte_waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                self._byte_waiters.remove(waiter)
+        self._in_flight += nbytes
+
+    def _release(self, nbytes):
+        self._sem.release()
+        if self.max_bytes is None:
+            return
+
+        self._in_flight -= nbytes
+        for waiter in self._byte_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _release_when_done(self, cf, nbytes):
+        # The limits are released when the thread is done rather than
+        # when the caller stops waiting, so a timed out or cancelled call
+        # that's already running still counts against them.
+        loop = asyncio.get_running_loop()
+
+        def done(_):
+            try:
+                loop.call_soon_threadsafe(self._release, nbytes)
+            except RuntimeError:
+                # loop is closed
+                pass
+
+        cf.add_done_callback(done)
+
+    async def _limited(self, size, fn, arg):
+        # size is len, or a stat function run on the worker threads too
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        await self._sem.acquire()
+
+        loop = asyncio.get_running_loop()
+        stat = None
+        try:
+            await self._configure()
+            if size is len:
+                nbytes = len(arg)
+            else:
+                stat = self._executor.submit(size, arg)
+                nbytes = (await asyncio.wrap_future(stat, loop=loop)).st_size
+                stat = None
+            if self._bytes_max is not None:
+                nbytes = min(nbytes, self._bytes_max)
+            await self._reserve(nbytes)
+        except BaseException:
+            if stat is None:
+                self._release(0)
+            else:
+                # the stat's thread may still be running
+                self._release_when_done(stat, 0)
+            raise
+
+        try:
+            cf = self._executor.submit(fn, arg)
+        except BaseException:
+            self._release(nbytes)
+            raise
+        self._release_when_done(cf, nbytes)
+        return await asyncio.wrap_future(cf, loop=loop)
+
+    async def _run(self, timeout, size, fn, arg):
+        if timeout is None:
+            timeout = self.timeout
+        return await asyncio.wait_for(self._limited(size, fn, arg), timeout)
+
+    async def from_buffer(self, buf, timeout=None):
+        """
+        Identify the contents of `buf`.
+        """
+        return await self._run(timeout, len, self._pool.from_buffer, buf)
+
+    async def from_file(self, filename, timeout=None):
+        """
+        Identify the file at `filename`.  The stat that sizes the call
+        counts against `timeout` and the limits too.
+        """
+        return await self._run(timeout, self._stat_path, self._pool.from_file, filename)
+
+    async def from_descriptor(self, fd, timeout=None):
+        """
+        Identify the open file descriptor `fd`.
+        """
+        return await self._run(timeout, os.fstat, self._pool.from_descriptor, fd)
+
+    def close(self):
+        """
+        Stop the worker threads and close idle cookies.  Calls that are
+        already running are allowed to finish.
+        """
+        self._executor.shutdown(wait=False)
+        self._pool.close()
+
+    async def __aenter__(self):
+        await self._configure()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
@@ -0,0 +1,125 @@
+"""
+Identify the members of zip and tar archives without extracting them.
+
+Magic.from_archive reads each member through zipfile or tarfile, and
+only as far as the prefix libmagic would read from a file.  Members that
+are themselves archives are descended into up to a depth limit.
+"""
+
+import tarfile
+import zipfile
+
+_ZIP_MAGIC = (b"PK\x03\x04", b"PK\x05\x06")
+# gzip, bzip2 and xz, which tarfile can read compressed tars from
+_COMPRESSED_MAGIC = (b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00")
+
+
+def _kind(head):
+    # "zip", "tar", "compressed" (maybe a compressed tar) or None
+    if head[:4] in _ZIP_MAGIC:
+        return "zip"
+    if head[257:262] == b"ustar":
+        return "tar"
+    for sig in _COMPRESSED_MAGIC:
+        if head[: len(sig)] == sig:
+            return "compressed"
+    return None
+
+
+def _seekable(fobj):
+    try:
+        return fobj.seekable()
+    except (AttributeError, OSError):
+        # members of a tar read as a stream
+        return False
+
+
+def _open(fobj, kind):
+    # return an open archive, or None if fobj turns out not to be one
+    if kind == "zip":
+        return zipfile.ZipFile(fobj)
+    try:
+        if _seekable(fobj):
+            return tarfile.open(fileobj=fobj, mode="r:*")
+        # members of a stream can only be read in order, once
+        return tarfile.open(fileobj=fobj, mode="r|*")
+    except tarfile.ReadError:
+        if kind == "compressed":
+            return None
+        raise
+
+
+def _entries(archive):
+    # yield (name, opener) for each regular file in the archive
+    if isinstance(archive, zipfile.ZipFile):
+        for info in archive.infolist():
+            if not info.is_dir():
+                yield info.filename, (lambda info=info: archive.open(info))
+    else:
+        for info in archive:
+            if info.isfile():
+                yield info.name, (lambda info=info: archive.extractfile(info))
+
+
+def iter_archive(magic, source, max_depth):
+    """
+    Yield (member name, result) for `source`, a path or binary file-like
+    object.  See Magic.from_archive.
+    """
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        with open(source, "rb") as fobj:
+            for item in iter_archive(magic, fobj, max_depth):
+                yield item
+        return
+
+    seekable = _seekable(source)
+    if seekable:
+        pos = source.tell()
+        kind = _kind(source.read(512))
+        source.seek(pos)
+    elif hasattr(source, "peek"):
+        kind = _kind(source.peek(512))
+    else:
+        kind = None
+    if kind == "zip" and not seekable:
+        raise ValueError("zip archives must be seekable")
+
+    try:
+        archive = _open(source, "zip" if kind == "zip" else "tar")
+    except (zipfile.BadZipFile, tarfile.ReadError):
+        raise ValueError("not a zip or tar archive")
+    with archive:
+        for item in _members(magic, archive, "", max_depth):
+            yield item
+
+
+def _members(magic, archive, prefix, depth):
+    for name, opener in _entries(archive):
+        name = prefix + name
+        kind = None
+        try:
+            with opener() as fobj:
+                # the prefix buffer is released before descending, since
+                # the nested members share it
+                with magic._stream_prefix(fobj) as view:
+                    result = magic.from_buffer(view)
+                    if depth > 0 and _seekable(fobj):
+                        kind = _kind(view)
+        except Exception as e:
+            # e.g. encrypted or corrupt members; carry on with the rest
+            yield name, e
+            continue
+        yield name, result
+
+        if kind is None:
+            continue
+        try:
+            with opener() as fobj:
+                nested = _open(fobj, kind)
+                if nested is None:
+                    continue
+                with nested:
+                    for item in _members(magic, nested, name + "/", depth - 1):
+                        yield item
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+            yield name + "/", e
@@ -0,0 +1,321 @@
+"""
+Benchmark python-magic.
+
+    python -m magic.bench --seeds DIR [--threads 1,2,4] [--processes 1,4] [-o out.json]
+
+A synthetic corpus is generated from a directory of seed files (the
+test/testdata directory of a source checkout will do) by truncating,
+padding and concatenating them.  Each combination of method, flag preset
+and worker count is run over the corpus, and per-call latency
+percentiles and overall throughput are written as JSON so runs against
+different libmagic and python-magic versions can be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import magic
+
+PRESETS = {
+    "plain": {},
+    "mime": {"mime": True},
+    "mime_encoding": {"mime_encoding": True},
+    "extension": {"extension": True},
+}
+
+METHODS = ("from_buffer", "from_file", "from_descriptor")
+
+
+def make_corpus(seed_dir, dest, count, seed=0):
+    """
+    Write `count` files derived from the files in `seed_dir` to `dest`
+    and return their paths.
+    """
+    rng = random.Random(seed)
+    seeds = []
+    for name in sorted(os.listdir(seed_dir)):
+        path = os.path.join(seed_dir, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                seeds.append(f.read())
+    if not seeds:
+        raise ValueError("no seed files in " + seed_dir)
+
+    paths = []
+    for i in range(count):
+        data = rng.choice(seeds)
+        kind = rng.randrange(4)
+        if kind == 1:
+            # truncated
+            data = data[: rng.randint(1, len(data))]
+        elif kind == 2:
+            # trailing junk
+            data = data + bytes(rng.getrandbits(8) for _ in range(rng.randint(1, 4096)))
+        elif kind == 3:
+            # two files glued together
+            data = data + rng.choice(seeds)
+        path = os.path.join(dest, "%06d" % i)
+        with open(path, "wb") as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def _call(m, method, path, data):
+    """
+    Run one identification and return its latency in seconds.
+    """
+    if method == "from_buffer":
+        start = time.perf_counter()
+        m.from_buffer(data)
+        return time.perf_counter() - start
+    if method == "from_file":
+        start = time.perf_counter()
+        m.from_file(path)
+        return time.perf_counter() - start
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        start = time.perf_counter()
+        m.from_descriptor(fd)
+        return time.perf_counter() - start
+    finally:
+        os.close(fd)
+
+
+def _load(method, paths):
+    if method != "from_buffer":
+        return [(path, None) for path in paths]
+    items = []
+    for path in paths:
+        with open(path, "rb") as f:
+            items.append((path, f.read()))
+    return items
+
+
+def _run_threads(method, kwargs, items, workers):
+    pool = magic.MagicPool(size=workers, **kwargs)
+    pool.warm(workers)
+    latencies = [[] for _ in range(workers)]
+
+    def work(i):
+        with pool.acquire() as m:
+            out = latencies[i]
+            for path, data in items[i::workers]:
+                out.append(_call(m, method, path, data))
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(workers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    pool.close()
+    return elapsed, [x for out in latencies for x in out]
+
+
+_worker_magic = None
+
+
+def _process_init(kwargs):
+    global _worker_magic
+    _worker_magic = magic.Magic(**kwargs)
+
+
+def _process_work(args):
+    # Returns the wall clock times the timed part started and ended, so
+    # the parent can time the run without the reads in _load.  time.time
+    # rather than perf_counter, which isn't comparable across processes.
+    method, paths = args
+    items = _load(method, paths)
+    start = time.time()
+    latencies = [_call(_worker_magic, method, path, data) for path, data in items]
+    return start, time.time(), latencies
+
+
+def _run_processes(method, kwargs, paths, workers):
+    import multiprocessing
+
+    pool = multiprocessing.Pool(workers, _process_init, (kwargs,))
+    try:
+        # make sure every worker has loaded its database before timing
+        pool.map(_process_work, [(method, paths[:1])] * workers, chunksize=1)
+        chunks = [(method, paths[i::workers]) for i in range(workers)]
+        results = pool.map(_process_work, chunks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = max(end for _, end, _ in results) - min(start for start, _, _ in results)
+    return elapsed, [x for _, _, out in results for x in out]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(elapsed, latencies):
+    latencies = sorted(latencies)
+    us = 1e6
+    return {
+        "calls": len(latencies),
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else None,
+        "latency_us": {
+            "mean": sum(latencies) / len(latencies) * us if latencies else None,
+            "p50": percentile(latencies, 50) * us if latencies else None,
+            "p90": percentile(latencies, 90) * us if latencies else None,
+            "p99": percentile(latencies, 99) * us if latencies else None,
+            "max": latencies[-1] * us if latencies else None,
+        },
+    }
+
+
+def _python_magic_version():
+    try:
+        from importlib.metadata import version
+    except ImportError:
+        return None
+    try:
+        return version("python-magic")
+    except Exception:
+        return None
+
+
+def run(paths, methods, presets, threads, processes, repeat=1):
+    """
+    Run every combination and return the list of result dicts.
+    """
+    results = []
+    for method in methods:
+        for preset in presets:
+            kwargs = PRESETS[preset]
+            for mode, counts in (("threads", threads), ("processes", processes)):
+                for workers in counts:
+                    for _ in range(repeat):
+                        if mode == "threads":
+                            elapsed, latencies = _run_threads(
+                                method, kwargs, _load(method, paths), workers
+                            )
+                        else:
+                            elapsed, latencies = _run_processes(
+                                method, kwargs, paths, workers
+                            )
+                        result = {
+                            "method": method,
+                            "preset": preset,
+                            "mode": mode,
+                            "workers": workers,
+                        }
+                        result.update(summarize(elapsed, latencies))
+                        results.append(result)
+    return results
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m magic.bench", description="Benchmark python-magic."
+    )
+    parser.add_argument(
+        "--seeds",
+        required=True,
+        help="directory of seed files for the corpus, e.g. test/testdata",
+    )
+    parser.add_argument(
+        "--files", type=int, default=200, help="corpus size (default: %(default)s)"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--methods",
+        default=",".join(METHODS),
+        help="comma separated methods (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--presets",
+        default="plain,mime,mime_encoding",
+        help="comma separated flag presets from %s (default: %%(default)s)"
+        % ", ".join(sorted(PRESETS)),
+    )
+    parser.add_argument(
+        "--threads",
+        type=_int_list,
+        default=[1, 2, 4],
+        help="comma separated thread counts (default: 1,2,4)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=_int_list,
+        default=[],
+        help="comma separated process counts (default: none)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="runs of each combination"
+    )
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    methods = [m for m in args.methods.split(",") if m]
+    presets = [p for p in args.presets.split(",") if p]
+    for m in methods:
+        if m not in METHODS:
+            parser.error("unknown method " + m)
+    for p in presets:
+        if p not in PRESETS:
+            parser.error("unknown preset " + p)
+    if not os.path.isdir(args.seeds):
+        parser.error("--seeds: no such directory: " + args.seeds)
+
+    tmp = tempfile.mkdtemp(prefix="magic-bench-")
+    try:
+        paths = make_corpus(args.seeds, tmp, args.files, args.seed)
+        results = run(
+            methods=methods,
+            presets=presets,
+            paths=paths,
+            threads=args.threads,
+            processes=args.processes,
+            repeat=args.repeat,
+        )
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {
+        "python_magic": _python_magic_version(),
+        "libmagic": magic.version() if magic._has_version else None,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "corpus": {"seeds": args.seeds, "files": args.files, "seed": args.seed},
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
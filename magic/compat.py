@@ -11,6 +11,8 @@ from ctypes import *
 
 from . import loader
 
+# The library is shared with the rest of python-magic, so look functions
+# up by index to get objects with our own prototypes.
 _libraries = {}
 _libraries['magic'] = loader.load_lib()
 
@@ -58,59 +60,59 @@ class magic_set(Structure):
 magic_set._fields_ = []
 magic_t = POINTER(magic_set)
 
-_open = _libraries['magic'].magic_open
+_open = _libraries['magic']['magic_open']
 _open.restype = magic_t
 _open.argtypes = [c_int]
 
-_close = _libraries['magic'].magic_close
+_close = _libraries['magic']['magic_close']
 _close.restype = None
 _close.argtypes = [magic_t]
 
-_file = _libraries['magic'].magic_file
+_file = _libraries['magic']['magic_file']
 _file.restype = c_char_p
 _file.argtypes = [magic_t, c_char_p]
 
-_descriptor = _libraries['magic'].magic_descriptor
+_descriptor = _libraries['magic']['magic_descriptor']
 _descriptor.restype = c_char_p
 _descriptor.argtypes = [magic_t, c_int]
 
-_buffer = _libraries['magic'].magic_buffer
+_buffer = _libraries['magic']['magic_buffer']
 _buffer.restype = c_char_p
 _buffer.argtypes = [magic_t, c_void_p, c_size_t]
 
-_error = _libraries['magic'].magic_error
+_error = _libraries['magic']['magic_error']
 _error.restype = c_char_p
 _error.argtypes = [magic_t]
 
-_setflags = _libraries['magic'].magic_setflags
+_setflags = _libraries['magic']['magic_setflags']
 _setflags.restype = c_int
 _setflags.argtypes = [magic_t, c_int]
 
-_load = _libraries['magic'].magic_load
+_load = _libraries['magic']['magic_load']
 _load.restype = c_int
 _load.argtypes = [magic_t, c_char_p]
 
-_compile = _libraries['magic'].magic_compile
+_compile = _libraries['magic']['magic_compile']
 _compile.restype = c_int
 _compile.argtypes = [magic_t, c_char_p]
 
-_check = _libraries['magic'].magic_check
+_check = _libraries['magic']['magic_check']
 _check.restype = c_int
 _check.argtypes = [magic_t, c_char_p]
 
-_list = _libraries['magic'].magic_list
+_list = _libraries['magic']['magic_list']
 _list.restype = c_int
 _list.argtypes = [magic_t, c_char_p]
 
-_errno = _libraries['magic'].magic_errno
+_errno = _libraries['magic']['magic_errno']
 _errno.restype = c_int
 _errno.argtypes = [magic_t]
 
-_getparam = _libraries['magic'].magic_getparam
+_getparam = _libraries['magic']['magic_getparam']
 _getparam.restype = c_int
 _getparam.argtypes = [magic_t, c_int, c_void_p]
 
-_setparam = _libraries['magic'].magic_setparam
+_setparam = _libraries['magic']['magic_setparam']
 _setparam.restype = c_int
 _setparam.argtypes = [magic_t, c_int, c_void_p]
 
@@ -302,21 +304,21 @@ class MagicDetect(object):
 
 threadlocal = threading.local()
 
-def _detect_make():
-    v = getattr(threadlocal, "magic_instance", None)
+def _detector():
+    # The detect_from_ functions share python-magic's detection path, which
+    # reads the input once for all three fields.
+    v = getattr(threadlocal, "detector", None)
     if v is None:
-        v = MagicDetect()
-        setattr(threadlocal, "magic_instance", v)
+        from magic import Magic
+        v = Magic()
+        setattr(threadlocal, "detector", v)
     return v
 
-def _create_filemagic(mime_detected, type_detected):
-    try:
-        mime_type, mime_encoding = mime_detected.split('; ')
-    except ValueError:
-        raise ValueError(mime_detected)
+_FIELDS = ('mime_type', 'encoding', 'name')
 
-    return FileMagic(name=type_detected, mime_type=mime_type,
-                     encoding=mime_encoding.replace('charset=', ''))
+def _create_filemagic(detected):
+    return FileMagic(name=detected.name, mime_type=detected.mime_type,
+                     encoding=detected.encoding)
 
 
 def detect_from_filename(filename):
@@ -324,9 +326,7 @@ def detect_from_filename(filename):
 
     Returns a `FileMagic` namedtuple.
     '''
-    x = _detect_make()
-    return _create_filemagic(x.mime_magic.file(filename),
-                             x.none_magic.file(filename))
+    return _create_filemagic(_detector()._detect_file(filename, _FIELDS))
 
 
 def detect_from_fobj(fobj):
@@ -336,9 +336,7 @@ def detect_from_fobj(fobj):
     '''
 
     file_descriptor = fobj.fileno()
-    x = _detect_make()
-    return _create_filemagic(x.mime_magic.descriptor(file_descriptor),
-                             x.none_magic.descriptor(file_descriptor))
+    return _create_filemagic(_detector()._detect_descriptor(file_descriptor, _FIELDS))
 
 
 def detect_from_content(byte_content):
@@ -347,6 +345,4 @@ def detect_from_content(byte_content):
     Returns a `FileMagic` namedtuple.
     '''
 
-    x = _detect_make()
-    return _create_filemagic(x.mime_magic.buffer(byte_content),
-                             x.none_magic.buffer(byte_content))
+    return _create_filemagic(_detector()._detect_buffer(byte_content, _FIELDS))
@@ -0,0 +1,263 @@
+"""
+Helpers for managing magic databases.
+
+libmagic parses text magic sources every time they are loaded, while a
+compiled .mgc file is used almost as is.  compile_cached compiles custom
+sources once with magic_compile and keeps the result in a cache
+directory, keyed by a hash of the source and the libmagic version.
+
+Every cookie normally holds its own copy of the database.
+SharedDatabase maps the compiled files into memory once and hands the
+same pages to every cookie through magic_load_buffers.  A process that
+forks after creating it passes the mapping on to its children.
+"""
+
+import hashlib
+import mmap
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from typing import Dict, Optional
+
+# Set this to override where compiled databases are kept.
+CACHE_DIR_ENV = "PYTHON_MAGIC_CACHE_DIR"
+
+# The first four bytes of a compiled database, in either byte order.
+_MGC_HEADERS = (b"\x1c\x04\x1e\xf1", b"\xf1\x1e\x04\x1c")
+
+
+def default_cache_dir():
+    """
+    Return the directory compiled databases are cached in.
+    """
+    path = os.environ.get(CACHE_DIR_ENV)
+    if path:
+        return path
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "python-magic")
+
+
+def compile_cached(magic_file, cache_dir=None):
+    """
+    Return `magic_file` with each text source replaced by the path of a
+    cached compiled copy, compiling it first if needed.
+
+    `magic_file` may be a list of paths separated by os.pathsep, as for
+    Magic().  Entries that are directories, already compiled, or fail to
+    compile are left for libmagic to handle as before.
+    """
+    if magic_file is None:
+        return None
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+
+    magic_file = os.fsdecode(magic_file)
+    return os.pathsep.join(
+        _compile_one(path, cache_dir) for path in magic_file.split(os.pathsep)
+    )
+
+
+def _compile_one(path, cache_dir):
+    if not os.path.isfile(path):
+        return path
+    with open(path, "rb") as f:
+        source = f.read()
+    if source[:4] in _MGC_HEADERS:
+        return path
+
+    from magic import version, _has_version
+
+    key = hashlib.sha256(source)
+    # the .mgc format is tied to the libmagic that wrote it
+    key.update(str(version() if _has_version else 0).encode("ascii"))
+    dest = os.path.join(cache_dir, key.hexdigest() + ".mgc")
+    if os.path.exists(dest):
+        return dest
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _compile(source, key.hexdigest(), cache_dir, dest)
+    except (OSError, subprocess.CalledProcessError):
+        return path
+    return dest
+
+
+def _compile(source, name, cache_dir, dest):
+    # magic_compile always writes "<basename>.mgc" to the current
+    # directory.  Changing directory isn't safe with other threads
+    # running, so compile in a child process instead.
+    tmp = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        with open(os.path.join(tmp, name), "wb") as f:
+            f.write(source)
+        # make sure the child imports this copy of python-magic
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [package_root]
+            + [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p]
+        )
+        subprocess.check_call(
+            [
+                sys.executable,
+                "-c",
+                "import sys, magic.database; magic.database._compile_here(sys.argv[1])",
+                name,
+            ],
+            cwd=tmp,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        # atomic, so concurrent compiles of the same source are harmless
+        os.replace(os.path.join(tmp, name + ".mgc"), dest)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _compile_here(filename):
+    from magic import (
+        MAGIC_NONE,
+        coerce_filename,
+        magic_close,
+        magic_compile,
+        magic_open,
+    )
+
+    cookie = magic_open(MAGIC_NONE)
+    try:
+        if magic_compile(cookie, coerce_filename(filename)) != 0:
+            sys.exit(1)
+    finally:
+        magic_close(cookie)
+
+
+def _has_rules(path):
+    # True if a text magic file has anything but comments and blank lines
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith(b"#"):
+                return True
+    return False
+
+
+def _database_files(magic_file, compile):
+    """
+    Resolve `magic_file` (or libmagic's default) to a list of compiled
+    database paths.
+    """
+    from magic import coerce_filename, magic_getpath, maybe_decode
+
+    # action 0 is FILE_LOAD, which applies the MAGIC environment variable
+    # and the compiled-in default
+    path = maybe_decode(magic_getpath(coerce_filename(magic_file), 0))
+
+    files = []
+    for p in path.split(os.pathsep):
+        if p.endswith(".mgc") and os.path.isfile(p):
+            files.append(p)
+        elif os.path.isfile(p + ".mgc"):
+            # libmagic prefers the compiled version when both exist
+            files.append(p + ".mgc")
+        elif os.path.isdir(p):
+            raise ValueError("can't share a directory of magic files: " + p)
+        elif os.path.isfile(p):
+            with open(p, "rb") as f:
+                header = f.read(4)
+            if header in _MGC_HEADERS:
+                files.append(p)
+            elif not _has_rules(p):
+                # e.g. the stock /etc/magic, which is only comments
+                continue
+            elif not compile:
+                raise ValueError(p + " is not compiled")
+            else:
+                compiled = compile_cached(p)
+                if compiled == p:
+                    raise ValueError("failed to compile " + p)
+                files.append(compiled)
+    if not files:
+        raise ValueError("no compiled magic database found in " + path)
+    return files
+
+
+class SharedDatabase:
+    """
+    A set of compiled magic databases mapped into memory once and loaded
+    by reference into any number of cookies.
+
+    The mappings are copy-on-write.  libmagic only writes to them to fix
+    the byte order of a database compiled on a machine of the other
+    endianness, so in practice every cookie, and every process forked
+    after the database was created, shares the same physical pages.
+    """
+
+    _instances: Dict[Optional[str], "SharedDatabase"] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, magic_file=None, compile=True):
+        """
+        Return the process-wide SharedDatabase for `magic_file`, creating
+        it on first use.
+        """
+        key = os.fsdecode(magic_file) if magic_file is not None else None
+        db = cls._instances.get(key)
+        if db is None:
+            with cls._instances_lock:
+                db = cls._instances.get(key)
+                if db is None:
+                    db = cls._instances[key] = cls(magic_file, compile)
+        return db
+
+    def __init__(self, magic_file=None, compile=True):
+        """
+        Map the compiled databases for `magic_file`, or libmagic's default
+        database if None.  Text sources are compiled with compile_cached
+        if `compile` is true, otherwise they are an error.
+        """
+        from ctypes import addressof, c_char, c_size_t, c_void_p
+
+        self.magic_file = magic_file
+        self.compile = compile
+        self.files = _database_files(magic_file, compile)
+        self._maps = []
+        self._views = []
+        for path in self.files:
+            with open(path, "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            self._maps.append(m)
+            # ctypes can only address writable buffers, which is why the
+            # mapping is copy-on-write rather than read-only
+            self._views.append((c_char * len(m)).from_buffer(m))
+
+        n = len(self._views)
+        self._buffers = (c_void_p * n)(*[addressof(v) for v in self._views])
+        self._sizes = (c_size_t * n)(*[len(v) for v in self._views])
+
+    def __reduce__(self):
+        # the mappings can't be pickled, so map the same files again in
+        # the unpickling process, sharing any mapping it already has
+        return SharedDatabase.get, (self.magic_file, self.compile)
+
+    def load(self, cookie):
+        """
+        Load the database into `cookie`.  The database must stay alive
+        as long as the cookie does.
+        """
+        from magic import magic_load_buffers
+
+        magic_load_buffers(cookie, self._buffers, self._sizes, len(self._views))
+
+    @property
+    def size(self):
+        """
+        Total size of the mapped databases in bytes.
+        """
+        return sum(self._sizes)
@@ -0,0 +1,239 @@
+"""
+A pure-Python pre-classifier for a few very common formats.
+
+Magic(mime=True, fast_path=True) checks the leading bytes of each input
+against a small table of unambiguous signatures before calling libmagic.
+The answer for each signature isn't hard-coded: it is whatever the
+instance's own cookie says about a canonical sample of the format, so
+it follows the loaded database and flags.  Inputs that don't match, or
+only match something ambiguous, fall through to libmagic.
+"""
+
+import struct
+import threading
+
+# bytes read from a file to match against
+HEAD_BYTES = 512
+
+# Leading entries that make libmagic report a zip as something more
+# specific: OpenDocument, EPUB, OOXML, JAR, APK, KMZ, iWork, IPA.
+_ZIP_SPECIAL = (
+    b"mimetype",
+    b"[Content_Types].xml",
+    b"_rels/",
+    b"docProps/",
+    b"word/",
+    b"xl/",
+    b"ppt/",
+    b"META-INF/",
+    b"AndroidManifest.xml",
+    b"classes.dex",
+    b"doc.kml",
+    b"Index/",
+    b"Payload/",
+)
+
+
+def _png(head):
+    # the IHDR chunk must follow; libmagic won't call it a PNG otherwise
+    return head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR"
+
+
+def _jpeg(head):
+    # libmagic needs more than the bare SOI marker
+    return len(head) > 3 and head[:3] == b"\xff\xd8\xff"
+
+
+def _pdf(head):
+    return head[:5] == b"%PDF-"
+
+
+def _gzip(head):
+    return head[:3] == b"\x1f\x8b\x08"
+
+
+def _zip(head):
+    # libmagic looks well past the local header for the names of
+    # specific formats, and calls shorter inputs data
+    if head[:4] != b"PK\x03\x04" or len(head) < 64:
+        return False
+    (name_len,) = struct.unpack("<H", head[26:28])
+    name = head[30 : 30 + name_len]
+    if len(name) < name_len or not name:
+        return False
+    for special in _ZIP_SPECIAL:
+        if name.startswith(special):
+            return False
+    return True
+
+
+def _png_sample():
+    return (
+        b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01"
+        b"\x08\x06\x00\x00\x00\x1f\x15\xc4\x89"
+    )
+
+
+def _zip_sample():
+    name = b"a.txt"
+    data = b"x" * 64
+    return (
+        b"PK\x03\x04"
+        + struct.pack("<HHHHHIIIHH", 20, 0, 0, 0, 0, 0, 64, 64, len(name), 0)
+        + name
+        + data
+    )
+
+
+# (name, first two bytes, test, canonical sample)
+SIGNATURES = (
+    ("png", b"\x89P", _png, _png_sample()),
+    (
+        "jpeg",
+        b"\xff\xd8",
+        _jpeg,
+        b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00",
+    ),
+    ("pdf", b"%P", _pdf, b"%PDF-1.4\n"),
+    ("gzip", b"\x1f\x8b", _gzip, b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03"),
+    ("zip", b"PK", _zip, _zip_sample()),
+)
+
+# ISO base media file brands, matched at offset 8 after "ftyp" at 4
+MP4_BRANDS = (
+    b"isom",
+    b"iso2",
+    b"mp41",
+    b"mp42",
+    b"avc1",
+    b"dash",
+    b"M4V ",
+    b"M4A ",
+    b"qt  ",
+    b"3gp4",
+    b"3gp5",
+    b"heic",
+    b"avif",
+)
+
+
+def _mp4_sample(brand):
+    return struct.pack(">I", 20) + b"ftyp" + brand + b"\x00\x00\x00\x00" + brand
+
+
+class _Signature:
+    __slots__ = ("name", "mime", "result", "uses")
+
+    def __init__(self, name, mime, result):
+        self.name = name
+        self.mime = mime
+        # mime in the instance's result_type
+        self.result = result
+        self.uses = 0
+
+
+class FastPath:
+    """
+    The signature table for one Magic instance.
+
+    identify - a function that runs the instance's cookie on a buffer
+        and returns libmagic's bytes, used to calibrate each signature
+    decode - converts libmagic's bytes to a result
+    verify_every - check one in this many answers of each signature
+        against libmagic, and disable signatures that disagree
+    """
+
+    head_bytes = HEAD_BYTES
+
+    def __init__(self, identify, decode, verify_every=None):
+        if verify_every is not None and verify_every < 1:
+            raise ValueError("verify_every must be at least 1")
+        self.verify_every = verify_every
+        self.disabled = {}
+        self._decode = decode
+        self._lock = threading.Lock()
+
+        by_prefix = {}
+        for name, prefix, test, sample in SIGNATURES:
+            sig = self._calibrate(name, identify, sample)
+            if sig is not None and test(sample):
+                by_prefix.setdefault(prefix, []).append((test, sig))
+        brands = {}
+        for brand in MP4_BRANDS:
+            name = "ftyp:" + brand.decode("ascii").strip()
+            sig = self._calibrate(name, identify, _mp4_sample(brand))
+            if sig is not None:
+                brands[brand] = sig
+
+        # replaced, never mutated, so lookups don't need the lock
+        self._by_prefix = by_prefix
+        self._brands = brands
+
+    def _calibrate(self, name, identify, sample):
+        from magic import maybe_decode
+
+        try:
+            raw = identify(sample)
+        except Exception as e:
+            self.disabled[name] = e
+            return None
+        mime = maybe_decode(raw) if raw is not None else None
+        if not mime or mime == "application/octet-stream":
+            # this database or these flags don't recognise it
+            self.disabled[name] = mime
+            return None
+        return _Signature(name, mime, self._decode(raw))
+
+    def lookup(self, head):
+        """
+        Return the signature matching the leading bytes of `head`, or
+        None.  `head` may be bytes or a ctypes char array.
+        """
+        for test, sig in self._by_prefix.get(head[:2], ()):
+            if test(head):
+                return sig
+        if head[4:8] == b"ftyp":
+            return self._brands.get(head[8:12])
+        return None
+
+    def sampled(self, sig):
+        """
+        Count a use of `sig` and return True if this answer should be
+        verified against libmagic.
+        """
+        if self.verify_every is None:
+            return False
+        # unlocked, so the count is approximate under contention
+        uses = sig.uses
+        sig.uses = uses + 1
+        return uses % self.verify_every == 0
+
+    def check(self, sig, result):
+        """
+        Disable `sig` if libmagic's `result` disagrees with it.
+        """
+        if result == sig.result:
+            return
+        with self._lock:
+            self.disabled[sig.name] = result
+            by_prefix = {}
+            for prefix, entries in self._by_prefix.items():
+                kept = [(test, s) for test, s in entries if s is not sig]
+                if kept:
+                    by_prefix[prefix] = kept
+            self._by_prefix = by_prefix
+            self._brands = dict(
+                (brand, s) for brand, s in self._brands.items() if s is not sig
+            )
+
+    def signatures(self):
+        """
+        Return a dict of the enabled signatures' names and answers.
+        """
+        result = dict(
+            (sig.name, sig.mime)
+            for entries in self._by_prefix.values()
+            for _, sig in entries
+        )
+        result.update((sig.name, sig.mime) for sig in self._brands.values())
+        return result
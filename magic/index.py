@@ -0,0 +1,237 @@
+"""
+A persistent index of from_file results.
+
+Magic(index=path) keeps each file's result in a SQLite database keyed by
+its absolute path and the instance's configuration, together with the
+stat fields that change when the file does.  A file whose device, inode,
+size, mtime and ctime are unchanged is answered from the index without
+being opened, so repeated scans of a mostly unchanged tree only read
+the files that are new or modified.
+
+The configuration includes the flags, the parameters, the libmagic
+version and the size and mtime of the database files, so results made
+with a different libmagic or database are never reused.  Several
+threads and processes can share one index: each thread has its own
+connection and the database is in WAL mode.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    path BLOB NOT NULL,
+    config TEXT NOT NULL,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ctime_ns INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (path, config)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS configs (
+    config TEXT PRIMARY KEY,
+    last_used INTEGER NOT NULL
+);
+"""
+
+# how often a configuration in use has its last_used refreshed
+_TOUCH_INTERVAL = 86400
+
+
+def database_fingerprint(magic_file=None):
+    """
+    Return a string that changes when the libmagic version or the
+    database files that `magic_file` (or the default database) resolve
+    to change.
+    """
+    from magic import (
+        _has_getpath,
+        _has_version,
+        coerce_filename,
+        magic_getpath,
+        maybe_decode,
+        version,
+    )
+
+    parts = [str(version() if _has_version else 0)]
+    if _has_getpath:
+        # action 0 is FILE_LOAD, which applies MAGIC and the default
+        path = maybe_decode(magic_getpath(coerce_filename(magic_file), 0))
+    else:
+        path = os.fsdecode(magic_file or "")
+
+    for p in path.split(os.pathsep):
+        candidates = [p, p + ".mgc"]
+        if os.path.isdir(p):
+            candidates += [os.path.join(p, name) for name in sorted(os.listdir(p))]
+        for c in candidates:
+            try:
+                st = os.stat(c)
+            except OSError:
+                continue
+            parts.append("%s:%d:%d" % (c, st.st_size, st.st_mtime_ns))
+    return hashlib.sha256(
+        "\n".join(parts).encode("utf-8", "surrogateescape")
+    ).hexdigest()
+
+
+class Index:
+    """
+    A SQLite index of from_file results.  Use Index.get() to share one
+    instance between every Magic in the process that names the same
+    file.
+    """
+
+    _instances: Dict[str, "Index"] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, path):
+        """
+        Return the process-wide Index for `path`, opening it on first use.
+        """
+        key = os.path.abspath(os.fsdecode(path))
+        index = cls._instances.get(key)
+        if index is None:
+            with cls._instances_lock:
+                index = cls._instances.get(key)
+                if index is None:
+                    index = cls._instances[key] = cls(key)
+        return index
+
+    def __init__(self, path):
+        self.path = os.fsdecode(path)
+        self._local = threading.local()
+        self._pid = os.getpid()
+        # configuration -> when this process last refreshed its last_used
+        self._used = {}
+        # create the schema up front so errors surface here
+        self._conn()
+
+    def __reduce__(self):
+        return Index.get, (self.path,)
+
+    def _conn(self):
+        if self._pid != os.getpid():
+            # connections can't cross fork; start over in the child
+            self._local = threading.local()
+            self._pid = os.getpid()
+            self._used = {}
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL keeps the index consistent without syncing every commit
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(filename):
+        """
+        Return the key a file is stored under.
+        """
+        return os.fsencode(os.path.abspath(os.fsdecode(filename)))
+
+    def lookup(self, key, config, st):
+        """
+        Return the stored result for `key` under `config` if the file
+        still matches the stat result `st`, otherwise None.
+        """
+        row = (
+            self._conn()
+            .execute(
+                "SELECT dev, ino, size, mtime_ns, ctime_ns, result FROM results"
+                " WHERE path = ? AND config = ?",
+                (key, config),
+            )
+            .fetchone()
+        )
+        if row is None or row[:5] != _fingerprint(st):
+            return None
+        # a scan where nothing changed only looks results up, and must
+        # still keep its configuration from being compacted away
+        self._touch(self._conn(), config)
+        return row[5]
+
+    def store(self, key, config, st, result):
+        """
+        Remember `result` for `key` under `config`, as of stat result `st`.
+        """
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, config) + _fingerprint(st) + (result,),
+        )
+        self._touch(conn, config)
+
+    def _touch(self, conn, config):
+        # record that config is in use, at most once a day per process,
+        # so compact() can tell which configurations are current
+        now = int(time.time())
+        if now - self._used.get(config, 0) >= _TOUCH_INTERVAL:
+            conn.execute("INSERT OR REPLACE INTO configs VALUES (?, ?)", (config, now))
+            self._used[config] = now
+
+    def compact(self, max_age=30 * 86400, prune_missing=True):
+        """
+        Drop results for configurations that haven't been used in
+        `max_age` seconds, e.g. those of an old libmagic, and if
+        `prune_missing` is true results for files that no longer exist.
+        Then shrink the database file.
+        """
+        conn = self._conn()
+        cutoff = int(time.time()) - max_age
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # _touch only writes once a day, so save the last use this
+            # process knows of before deciding what is stale
+            used = [(config, t) for config, t in self._used.items()]
+            conn.executemany("INSERT OR IGNORE INTO configs VALUES (?, ?)", used)
+            conn.executemany(
+                "UPDATE configs SET last_used = MAX(last_used, ?) WHERE config = ?",
+                [(t, config) for config, t in used],
+            )
+            conn.execute(
+                "DELETE FROM results WHERE config NOT IN"
+                " (SELECT config FROM configs WHERE last_used >= ?)",
+                (cutoff,),
+            )
+            conn.execute("DELETE FROM configs WHERE last_used < ?", (cutoff,))
+            conn.execute("COMMIT")
+            # configurations in use here are registered again on next use
+            self._used = {}
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        if prune_missing:
+            missing = [
+                (path,)
+                for (path,) in conn.execute("SELECT DISTINCT path FROM results")
+                if not os.path.lexists(os.fsdecode(path))
+            ]
+            conn.executemany("DELETE FROM results WHERE path = ?", missing)
+
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        """
+        Close this thread's connection.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _fingerprint(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
@@ -1,11 +1,19 @@
-from ctypes.util import find_library
 import ctypes
 import sys
-import glob
+import os
 import os.path
-import logging
+import threading
 
-logger = logging.getLogger(__name__)
+# Set this to the path of the libmagic shared library to skip the search.
+LIBRARY_ENV = "PYTHON_MAGIC_LIBRARY"
+
+
+def find_library(name):
+    # ctypes.util is slow to import and find_library itself can spawn
+    # ldconfig or gcc on Linux, so only pay for it when needed.
+    from ctypes.util import find_library
+
+    return find_library(name)
 
 
 def _lib_candidates_linux():
@@ -18,6 +26,8 @@ def _lib_candidates_linux():
 
 def _lib_candidates_macos():
     """Yield possible libmagic library names on macOS."""
+    import glob
+
     paths = [
         "/opt/homebrew/lib",
         "/opt/local/lib",
@@ -45,6 +55,16 @@ def _lib_candidates_windows():
 
 
 def _lib_candidates():
+    override = os.environ.get(LIBRARY_ENV)
+    if override:
+        yield override
+        return
+
+    if sys.platform in ("linux", "sunos5"):
+        # The soname is nearly always right, and dlopen'ing it directly is
+        # much cheaper than asking find_library.
+        yield "libmagic.so.1"
+
     yield find_library("magic")
 
     func = {
@@ -61,12 +81,34 @@ def _lib_candidates():
         yield path
 
 
+_lib = None
+_lib_lock = threading.Lock()
+
+
 def load_lib():
+    """
+    Return the libmagic CDLL.  The library is found and loaded once per
+    process and shared by every caller.
+
+    Callers that declare their own prototypes should get functions with
+    `lib["name"]` rather than `lib.name`, which returns a shared object.
+    """
+    global _lib
+    if _lib is None:
+        with _lib_lock:
+            if _lib is None:
+                _lib = _load_lib()
+    return _lib
+
+
+def _load_lib():
     exc = []
+    seen = set()
     for lib in _lib_candidates():
         # find_library returns None when lib not found
-        if lib is None:
+        if lib is None or lib in seen:
             continue
+        seen.add(lib)
 
         try:
             return ctypes.CDLL(lib)
@@ -0,0 +1,67 @@
+"""
+Identify many files or buffers using a pool of worker processes.
+
+Threads are enough when most of the time is spent waiting on I/O, but
+rules like regex, ELF and CDF checks are CPU bound.  identify_many
+spreads that work across processes.  Each worker builds its Magic once
+when it starts, so the database is loaded once per worker rather than
+once per item.
+"""
+
+_magic = None
+
+
+def _init_worker(kwargs):
+    global _magic
+    from magic import Magic
+
+    _magic = Magic(**kwargs)
+
+
+def _identify(item):
+    try:
+        if isinstance(item, (bytes, bytearray)):
+            return _magic.from_buffer(item)
+        return _magic.from_file(item)
+    except Exception as e:
+        return e
+
+
+def _identify_indexed(arg):
+    index, item = arg
+    return index, _identify(item)
+
+
+def identify_many(items, workers=None, ordered=True, chunksize=16, **kwargs):
+    """
+    Identify each entry of `items` in a pool of `workers` processes.
+
+    Entries that are bytes or bytearray are treated as buffers, anything
+    else (str or os.PathLike) as a filename.  Remaining keyword arguments
+    are passed to Magic() in every worker.
+
+    This is a generator.  If `ordered` is true it yields one result per
+    input in input order, otherwise it yields (index, result) pairs as
+    soon as they complete.  Items are sent to workers `chunksize` at a
+    time.  As with Magic.from_buffers, failures are yielded as exception
+    instances rather than raised.
+    """
+    import multiprocessing
+
+    pool = multiprocessing.Pool(workers, _init_worker, (kwargs,))
+    try:
+        if ordered:
+            results = pool.imap(_identify, items, chunksize)
+        else:
+            results = pool.imap_unordered(
+                _identify_indexed, enumerate(items), chunksize
+            )
+        for result in results:
+            yield result
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
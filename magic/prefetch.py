@@ -0,0 +1,125 @@
+"""
+Identify many files with reads and matching pipelined.
+
+On network and FUSE filesystems from_file is bound by latency: libmagic
+opens and reads one file at a time, so a cookie is idle for every round
+trip.  prefetch_files splits the work into two stages.  An I/O stage of
+`io_depth` threads opens each file and has the kernel read ahead the
+prefix libmagic would read, with many files in flight at once, so that
+the data is in the page cache by the time it is needed.  A matching
+stage of `match_workers` cookies then runs magic_descriptor on the
+descriptors already open.  The two are sized separately: deep I/O to
+hide latency, few cookies to match.
+"""
+
+import os
+import stat
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+def _read_ahead(fd, n):
+    # Start reading the first n bytes into the page cache.  Mounts that
+    # bypass the cache ignore the advice, so nothing is read twice.
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, n, os.POSIX_FADV_WILLNEED)
+            return
+        except OSError:
+            # some filesystems don't support it
+            pass
+    os.read(fd, n)
+    os.lseek(fd, 0, os.SEEK_SET)
+
+
+def prefetch_files(filenames, io_depth=32, match_workers=None, **kwargs):
+    """
+    Identify each file in the iterable `filenames`, yielding one result
+    per input in order.  Failures are yielded as exception instances.
+
+    io_depth - number of files being opened and read ahead at once
+    match_workers - number of cookies matching files.  Defaults to the
+        MagicPool default size.
+    kwargs - passed through to Magic()
+
+    Results are the same as from_file's: libmagic reads each file through
+    its descriptor, as from_file does, and so can still look past the
+    prefix, e.g. at the end of a zip.  Files that aren't regular or are
+    empty, and all files with uncompress="python", are identified by
+    name.  With index, files the index already knows aren't read at all;
+    file_cache is not consulted.
+    """
+    from magic import _DEFAULT_BYTES_MAX, MAGIC_SYMLINK, MagicPool
+
+    if io_depth < 1:
+        raise ValueError("io_depth must be at least 1")
+
+    pool = MagicPool(size=match_workers, **kwargs)
+    with pool.acquire() as m:
+        limit = m._bytes_max or _DEFAULT_BYTES_MAX
+        follow = m.flags & MAGIC_SYMLINK
+        index = m._index
+        config = None
+        if index is not None:
+            config = m._index_config or m._make_index_config()
+
+    matcher = ThreadPoolExecutor(pool.size)
+
+    def match(path, st, fd):
+        try:
+            with pool.acquire() as m:
+                if fd is None or m._uncompress is not None:
+                    # in-process uncompress reads descriptors as streams
+                    result = m._identify_file(path, st)
+                else:
+                    result = m.from_descriptor(fd)
+        finally:
+            if fd is not None:
+                os.close(fd)
+        if index is not None:
+            index.store(index.key(path), config, st, result)
+        return result
+
+    def fetch(path):
+        # runs in the I/O stage; returns a result or a matching future
+        st = os.stat(path, follow_symlinks=follow)
+        if index is not None:
+            result = index.lookup(index.key(path), config, st)
+            if result is not None:
+                return result
+        if not stat.S_ISREG(st.st_mode) or not st.st_size:
+            return matcher.submit(match, path, st, None)
+
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            _read_ahead(fd, min(st.st_size, limit))
+            return matcher.submit(match, path, st, fd)
+        except BaseException:
+            os.close(fd)
+            raise
+
+    def result(fut):
+        try:
+            value = fut.result()
+            if isinstance(value, Future):
+                value = value.result()
+            return value
+        except Exception as e:
+            return e
+
+    window = io_depth + pool.size * 2
+    pending = deque()
+    reader = ThreadPoolExecutor(io_depth)
+    try:
+        for path in filenames:
+            pending.append(reader.submit(fetch, path))
+            if len(pending) >= window:
+                yield result(pending.popleft())
+        while pending:
+            yield result(pending.popleft())
+    finally:
+        for fut in pending:
+            fut.cancel()
+        reader.shutdown(wait=True)
+        matcher.shutdown(wait=True)
+        pool.close()
@@ -0,0 +1,211 @@
+"""
+Identify every file under a directory tree using a pool of threads.
+"""
+
+import os
+import stat
+import threading
+from collections import deque
+from fnmatch import fnmatch
+
+
+def _matches(name, patterns):
+    for pattern in patterns:
+        if fnmatch(name, pattern):
+            return True
+    return False
+
+
+def _walk(root, include, exclude, follow_symlinks):
+    """
+    Yield (path, stat_result) for each file to classify, or (path,
+    OSError) for entries that couldn't be read.
+
+    Directory detection uses the d_type that scandir already has, so
+    directories are only stat'd when following symlinks, to detect loops.
+    """
+    try:
+        st = os.stat(root, follow_symlinks=follow_symlinks)
+    except OSError as e:
+        yield root, e
+        return
+    if not stat.S_ISDIR(st.st_mode):
+        yield root, st
+        return
+
+    visited = set([(st.st_dev, st.st_ino)])
+    stack = [root]
+    while stack:
+        top = stack.pop()
+        try:
+            # read the whole directory so its fd isn't held open while
+            # the caller is consuming results
+            with os.scandir(top) as it:
+                entries = list(it)
+        except OSError as e:
+            yield top, e
+            continue
+
+        dirs = []
+        for entry in entries:
+            if exclude and _matches(entry.name, exclude):
+                continue
+
+            try:
+                is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                if follow_symlinks:
+                    try:
+                        st = entry.stat()
+                    except OSError as e:
+                        yield entry.path, e
+                        continue
+                    key = (st.st_dev, st.st_ino)
+                    if key in visited:
+                        continue
+                    visited.add(key)
+                dirs.append(entry.path)
+                continue
+
+            if include and not _matches(entry.name, include):
+                continue
+
+            try:
+                st = entry.stat(follow_symlinks=follow_symlinks)
+            except OSError as e:
+                yield entry.path, e
+                continue
+            yield entry.path, st
+
+        stack.extend(reversed(dirs))
+
+
+def scan_tree(
+    root,
+    workers=None,
+    include=None,
+    exclude=None,
+    follow_symlinks=False,
+    per_device=None,
+    **kwargs,
+):
+    """
+    Identify every file under `root`, yielding (path, result) pairs.
+
+    workers - number of threads, each with its own cookie.  Defaults to
+        the MagicPool default size.
+    include - if given, only files whose name matches one of these
+        fnmatch patterns are identified
+    exclude - files and directories whose name matches one of these
+        fnmatch patterns are skipped
+    follow_symlinks - as for Magic: if False symlinks are reported as
+        links and never descended into, if True they are resolved
+    per_device - maximum number of concurrent calls on any one device.
+        Files beyond that wait in the walk, not in a worker thread, so
+        the threads stay busy with other devices meanwhile.
+    kwargs - passed through to Magic(), e.g. index to skip files that
+        haven't changed since an earlier scan
+
+    Results are yielded in the order the walk finds them.  Files with
+    more than one hard link are only identified once.  Errors, including
+    unreadable directories, are yielded as exception instances.
+    """
+    from concurrent.futures import Future, ThreadPoolExecutor
+    from magic import MagicPool
+
+    pool = MagicPool(size=workers, follow_symlinks=follow_symlinks, **kwargs)
+    workers = pool.size
+    linked = {}
+
+    # with per_device, the calls submitted for each device and the
+    # (path, st, future) of files waiting for one of them to finish
+    devices_lock = threading.Lock()
+    running = {}
+    waiting = {}
+
+    def classify(path, st):
+        try:
+            with pool.acquire() as m:
+                return m._from_file(path, st)
+        except Exception as e:
+            return e
+
+    def start(path, st, fut):
+        def run():
+            try:
+                if fut.set_running_or_notify_cancel():
+                    fut.set_result(classify(path, st))
+            finally:
+                finished(st.st_dev)
+
+        try:
+            executor.submit(run)
+        except RuntimeError:
+            # the scan was closed while another file finished
+            fut.cancel()
+
+    def finished(dev):
+        # hand the device's slot to the next file waiting for it
+        with devices_lock:
+            queue = waiting.get(dev)
+            if not queue:
+                running[dev] -= 1
+                return
+            item = queue.popleft()
+        start(*item)
+
+    def submit(path, st):
+        if per_device is None:
+            return executor.submit(classify, path, st)
+        fut = Future()
+        with devices_lock:
+            if running.get(st.st_dev, 0) >= per_device:
+                waiting.setdefault(st.st_dev, deque()).append((path, st, fut))
+                return fut
+            running[st.st_dev] = running.get(st.st_dev, 0) + 1
+        start(path, st, fut)
+        return fut
+
+    def result(fut):
+        if isinstance(fut, Exception):
+            return fut
+        return fut.result()
+
+    pending = deque()
+    executor = ThreadPoolExecutor(workers)
+    try:
+        for path, st in _walk(root, include, exclude, follow_symlinks):
+            if isinstance(st, Exception):
+                pending.append((path, st))
+                continue
+
+            if st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+                fut = linked.get(key)
+                if fut is not None:
+                    pending.append((path, fut))
+                    continue
+
+            fut = submit(path, st)
+            if st.st_nlink > 1:
+                linked[(st.st_dev, st.st_ino)] = fut
+            pending.append((path, fut))
+
+            while len(pending) > workers * 4:
+                path, fut = pending.popleft()
+                yield path, result(fut)
+
+        while pending:
+            path, fut = pending.popleft()
+            yield path, result(fut)
+    finally:
+        with devices_lock:
+            waiting.clear()
+        for path, fut in pending:
+            if not isinstance(fut, Exception):
+                fut.cancel()
+        executor.shutdown(wait=True)
+        pool.close()
@@ -0,0 +1,295 @@
+"""
+Optional instrumentation for Magic.
+
+Magic(stats=True) or Magic(hooks=...) moves the instance to a subclass
+of its own that wraps the entry points, and replaces the instance lock
+with a _TimedLock.  Instances created without them run the plain class
+methods and a plain lock, so instrumentation costs nothing unless it is
+used.
+"""
+
+import os
+import stat
+import threading
+import time
+
+# the entry points that are counted and passed to hooks
+ENTRY_POINTS = ("from_buffer", "from_stream", "from_file", "from_descriptor", "detect")
+BATCH_ENTRY_POINTS = ("from_buffers", "from_files", "from_descriptors")
+
+
+class Hooks:
+    """
+    Base class for instrumentation hooks.  Subclass it and override
+    either method, then pass instances as Magic(hooks=[...]).
+
+    Hooks run around each call to from_buffer, from_stream, from_file,
+    from_descriptor and detect, on the calling thread.  Calls those
+    methods make to each other internally are not reported again.
+    Batch methods are counted in stats() but not passed to hooks.
+    """
+
+    def before(self, method, source):
+        """
+        Called before `method` is run on `source`.  The return value is
+        passed to after() as `token`.
+        """
+        return None
+
+    def after(self, method, source, result, error, seconds, token):
+        """
+        Called when `method` returns `result` or raises `error` (the
+        other is None), `seconds` after it started.
+        """
+
+
+class Histogram:
+    """
+    Counts of durations in power-of-two buckets of nanoseconds.
+    """
+
+    __slots__ = ("count", "total", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.buckets = [0] * 64
+
+    def add(self, ns):
+        self.count += 1
+        self.total += ns
+        # bucket i holds durations in [2**(i-1), 2**i) ns
+        self.buckets[min(ns.bit_length(), 63)] += 1
+
+    def snapshot(self):
+        """
+        Return a dict with the count, the total in seconds and a list of
+        (upper bound in seconds, count) for each non-empty bucket.
+        """
+        return {
+            "count": self.count,
+            "total": self.total / 1e9,
+            "buckets": [((1 << i) / 1e9, n) for i, n in enumerate(self.buckets) if n],
+        }
+
+
+class MagicStats:
+    """
+    Counters for one Magic instance.  Use Magic.stats() to read them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+            self.errors = {}
+            self.bytes = 0
+            self.fallbacks = 0
+            self.call_time = Histogram()
+            self.lock_wait = Histogram()
+            self.lock_hold = Histogram()
+
+    def add_call(self, method, ns, failed):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if failed:
+                self.errors[method] = self.errors.get(method, 0) + 1
+            if ns is not None:
+                self.call_time.add(ns)
+
+    def add_bytes(self, n):
+        with self._lock:
+            self.bytes += n
+
+    def add_fallback(self):
+        with self._lock:
+            self.fallbacks += 1
+
+    def add_lock(self, wait_ns, hold_ns):
+        with self._lock:
+            self.lock_wait.add(wait_ns)
+            self.lock_hold.add(hold_ns)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "errors": dict(self.errors),
+                "bytes": self.bytes,
+                "fallbacks": self.fallbacks,
+                "call_time": self.call_time.snapshot(),
+                "lock_wait": self.lock_wait.snapshot(),
+                "lock_hold": self.lock_hold.snapshot(),
+            }
+
+
+class _TimedLock:
+    """
+    A lock that records how long each acquisition waited and how long the
+    lock was then held.  Magic only holds its lock around libmagic calls,
+    so the hold time is the time spent in libmagic.
+    """
+
+    def __init__(self, stats, lock=None):
+        self._stats = stats
+        self._lock = lock if lock is not None else threading.Lock()
+        self._acquired = 0
+        self._waited = 0
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter_ns()
+        if not self._lock.acquire(blocking, timeout):
+            return False
+        self._acquired = time.perf_counter_ns()
+        self._waited = self._acquired - start
+        return True
+
+    def release(self):
+        hold = time.perf_counter_ns() - self._acquired
+        wait = self._waited
+        self._lock.release()
+        self._stats.add_lock(wait, hold)
+
+    def locked(self):
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _examined(st, limit, pos=0):
+    # libmagic reads at most `limit` bytes of a regular file, starting
+    # from the current position for descriptors
+    if not stat.S_ISREG(st.st_mode):
+        return 0
+    n = max(st.st_size - pos, 0)
+    return n if limit is None else min(n, limit)
+
+
+def install(magic, stats, hooks):
+    """
+    Instrument `magic` by moving it to a subclass of its class, made for
+    it alone, whose methods wrap the originals.
+    """
+    from magic import MAGIC_SYMLINK
+
+    cls = type(magic)
+    local = threading.local()
+    hooks = tuple(hooks)
+
+    def entry(name, fn):
+        def wrapper(self, source, *args, **kwargs):
+            if getattr(local, "active", False):
+                return fn(self, source, *args, **kwargs)
+            local.active = True
+            try:
+                tokens = [h.before(name, source) for h in hooks]
+                start = time.perf_counter_ns()
+                result = error = None
+                try:
+                    result = fn(self, source, *args, **kwargs)
+                    return result
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    ns = time.perf_counter_ns() - start
+                    if stats is not None:
+                        stats.add_call(name, ns, error is not None)
+                    for h, token in zip(hooks, tokens):
+                        h.after(name, source, result, error, ns / 1e9, token)
+            finally:
+                local.active = False
+
+        return wrapper
+
+    def batch(name, fn):
+        def wrapper(self, items, *args, **kwargs):
+            for result in fn(self, items, *args, **kwargs):
+                stats.add_call(name, None, isinstance(result, Exception))
+                yield result
+
+        return wrapper
+
+    def counted(fn, measure):
+        # count the bytes libmagic will examine, then call through.  This
+        # runs first so descriptor positions haven't moved yet.
+        def wrapper(self, *args):
+            stats.add_bytes(measure(self, *args))
+            return fn(self, *args)
+
+        return wrapper
+
+    def fd_size(self, fd):
+        try:
+            return _examined(
+                os.fstat(fd), self._bytes_max, os.lseek(fd, 0, os.SEEK_CUR)
+            )
+        except OSError:
+            return 0
+
+    def path_size(self, filename):
+        try:
+            st = os.stat(filename, follow_symlinks=self.flags & MAGIC_SYMLINK)
+        except OSError:
+            return 0
+        return _examined(st, self._bytes_max)
+
+    def buffer_arg(self, buf):
+        view = cls._buffer_arg(self, buf)
+        stats.add_bytes(len(view))
+        return view
+
+    def handle509(self, e):
+        result = cls._handle509Bug(self, e)
+        stats.add_fallback()
+        return result
+
+    def batch_result(self, result):
+        value = cls._batch_result(self, result)
+        if result is None and not isinstance(value, Exception):
+            stats.add_fallback()
+        return value
+
+    # A class per instance rather than wrappers in the instance's dict:
+    # those would have to reference the instance, and a call like
+    # Magic(stats=True).from_file(path) would lose it mid-call.
+    namespace = {"__module__": cls.__module__, "__qualname__": cls.__qualname__}
+    from_descriptor = cls.from_descriptor
+    if stats is not None:
+        magic.lock = _TimedLock(stats)
+        from_descriptor = counted(from_descriptor, fd_size)
+        namespace.update(
+            {
+                "_buffer_arg": buffer_arg,
+                "_from_file": counted(
+                    cls._from_file,
+                    lambda self, filename, st: _examined(st, self._bytes_max),
+                ),
+                "_detect_descriptor": counted(
+                    cls._detect_descriptor, lambda self, fd, fields: fd_size(self, fd)
+                ),
+                "_file_chunk": counted(
+                    cls._file_chunk,
+                    lambda self, chunk: sum(path_size(self, f) for f in chunk),
+                ),
+                "_descriptor_chunk": counted(
+                    cls._descriptor_chunk,
+                    lambda self, chunk: sum(fd_size(self, fd) for fd in chunk),
+                ),
+                "_handle509Bug": handle509,
+                "_batch_result": batch_result,
+            }
+        )
+        for name in BATCH_ENTRY_POINTS:
+            namespace[name] = batch(name, getattr(cls, name))
+
+    for name in ENTRY_POINTS:
+        fn = from_descriptor if name == "from_descriptor" else getattr(cls, name)
+        namespace[name] = entry(name, fn)
+    magic.__class__ = type(cls.__name__, (cls,), namespace)
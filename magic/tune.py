@@ -0,0 +1,140 @@
+"""
+Find which libmagic check categories can be turned off for a corpus.
+
+Each check_* argument to Magic() disables one group of libmagic tests.
+profile_checks times every group on a sample of your data, finds the
+groups that never change the results for it, and recommends a
+combination of them that keeps every result identical.
+"""
+
+import time
+from collections import namedtuple
+
+import magic
+
+# Magic() arguments that each turn off one category of tests
+CHECKS = (
+    "check_tar",
+    "check_soft",
+    "check_apptype",
+    "check_elf",
+    "check_text",
+    "check_cdf",
+    "check_csv",
+    "check_encoding",
+    "check_json",
+    "check_simh",
+)
+
+CheckProfile = namedtuple("CheckProfile", ("seconds", "saving", "changed"))
+CheckProfile.__doc__ = """
+seconds - time per item with only this check disabled
+saving - seconds per item saved compared to the baseline
+changed - number of sample items whose result changed
+"""
+
+TuneResult = namedtuple(
+    "TuneResult", ("kwargs", "baseline", "tuned", "speedup", "checks")
+)
+TuneResult.__doc__ = """
+kwargs - the recommended Magic() arguments
+baseline - seconds per item with the arguments given
+tuned - seconds per item with the recommended arguments
+speedup - baseline / tuned
+checks - a CheckProfile for each check that was tried
+"""
+
+
+def _pass(m, corpus, fields):
+    start = time.perf_counter()
+    for item in corpus:
+        _detect(m, item, fields)
+    return time.perf_counter() - start
+
+
+def _compare(base, m, corpus, fields, repeat):
+    # Alternate timed passes so drift in machine load affects both
+    # configurations alike, and keep the fastest pass of each.
+    base_best = best = None
+    for _ in range(repeat):
+        t = _pass(base, corpus, fields)
+        base_best = t if base_best is None else min(base_best, t)
+        t = _pass(m, corpus, fields)
+        best = t if best is None else min(best, t)
+    return base_best / len(corpus), best / len(corpus)
+
+
+def _detect(m, item, fields):
+    try:
+        return m.detect(item, fields)
+    except magic.MagicException as e:
+        return e.message
+
+
+def _changed(a, b):
+    return sum(1 for x, y in zip(a, b) if x != y)
+
+
+def profile_checks(
+    corpus, target_fields=("mime_type",), repeat=3, checks=CHECKS, **kwargs
+):
+    """
+    Profile the check categories on `corpus` and return a TuneResult.
+
+    corpus - filenames and/or buffers to identify; bytes are buffers
+    target_fields - the Magic.detect fields that must not change
+    repeat - timed passes over the corpus per configuration, alternating
+        with passes of the baseline; the fastest pass of each is used
+    checks - the check_* arguments to try disabling
+    kwargs - the Magic() arguments to start from
+
+    Each check is first disabled on its own.  Those that leave every
+    result unchanged are then disabled together one at a time, fastest
+    saving first, keeping each only if the results are still identical.
+    Results are only guaranteed for files like the ones in the sample.
+    """
+    corpus = list(corpus)
+    if not corpus:
+        raise ValueError("corpus is empty")
+    for check in checks:
+        if check not in CHECKS:
+            raise ValueError("unknown check " + repr(check))
+
+    base = magic.Magic(**kwargs)
+    # the untimed first pass also warms up the cookie
+    baseline = [_detect(base, item, target_fields) for item in corpus]
+
+    def trial(trial_kwargs):
+        m = magic.Magic(**trial_kwargs)
+        changed = _changed(
+            baseline, [_detect(m, item, target_fields) for item in corpus]
+        )
+        return m, changed
+
+    profiles = {}
+    for check in checks:
+        if kwargs.get(check, True) is False:
+            # already disabled
+            continue
+        m, changed = trial(dict(kwargs, **{check: False}))
+        base_time, seconds = _compare(base, m, corpus, target_fields, repeat)
+        profiles[check] = CheckProfile(seconds, base_time - seconds, changed)
+
+    candidates = sorted(
+        (c for c, p in profiles.items() if not p.changed),
+        key=lambda c: profiles[c].saving,
+        reverse=True,
+    )
+    tuned = dict(kwargs)
+    for check in candidates:
+        trial_kwargs = dict(tuned, **{check: False})
+        # Checks can interact, so the combination has to be verified.
+        # Disabling a check never adds work, so small or negative
+        # savings are timing noise and don't disqualify it.
+        if not trial(trial_kwargs)[1]:
+            tuned = trial_kwargs
+
+    m = magic.Magic(**tuned)
+    _pass(m, corpus, target_fields)
+    base_time, tuned_time = _compare(base, m, corpus, target_fields, repeat)
+    return TuneResult(tuned, base_time, tuned_time, base_time / tuned_time, profiles)
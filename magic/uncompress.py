@@ -0,0 +1,135 @@
+"""
+Look inside compressed inputs without leaving the process.
+
+Magic(uncompress="python") recognises gzip, bzip2, xz, zstd and lz4
+from their headers and decompresses them here, with the incremental
+decompressors from the standard library (zstd and lz4 need the
+`zstandard` and `lz4` packages, or Python's own compression.zstd).  Only
+as much output is produced as libmagic would examine.  libmagic never
+sees MAGIC_COMPRESS, so it never forks a decompressor.  Results are
+formatted the way libmagic formats them under MAGIC_COMPRESS.
+"""
+
+import bz2
+import lzma
+import zlib
+
+# enough leading bytes to recognise every format below
+HEAD_BYTES = 6
+
+
+def _gzip(data, limit):
+    # 16 + MAX_WBITS: expect a gzip header and trailer
+    return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data, limit)
+
+
+def _bzip2(data, limit):
+    return bz2.BZ2Decompressor().decompress(data, limit)
+
+
+def _xz(data, limit):
+    return lzma.LZMADecompressor(lzma.FORMAT_XZ).decompress(data, limit)
+
+
+def _zstd():
+    try:
+        from compression import zstd  # type: ignore[import-not-found]
+
+        return lambda data, limit: zstd.ZstdDecompressor().decompress(data, limit)
+    except ImportError:
+        pass
+    try:
+        import io
+        import zstandard  # type: ignore[import-not-found]
+    except ImportError:
+        return None
+
+    def decompress(data, limit):
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+        out = []
+        n = 0
+        while n < limit:
+            block = reader.read(limit - n)
+            if not block:
+                break
+            out.append(block)
+            n += len(block)
+        return b"".join(out)
+
+    return decompress
+
+
+def _lz4():
+    try:
+        import lz4.frame  # type: ignore[import-not-found]
+    except ImportError:
+        return None
+    return lambda data, limit: lz4.frame.LZ4FrameDecompressor().decompress(
+        data, max_length=limit
+    )
+
+
+def _is_bzip2(head):
+    return head[:3] == b"BZh" and head[3:4].isdigit()
+
+
+# (name, test on the leading bytes, decompress function or None)
+FORMATS = (
+    ("gzip", lambda head: head[:2] == b"\x1f\x8b", _gzip),
+    ("bzip2", _is_bzip2, _bzip2),
+    ("xz", lambda head: head[:6] == b"\xfd7zXZ\x00", _xz),
+    ("zstd", lambda head: head[:4] == b"\x28\xb5\x2f\xfd", _zstd()),
+    ("lz4", lambda head: head[:4] == b"\x04\x22\x4d\x18", _lz4()),
+)
+
+# decompression errors, which leave the input to be described as is
+_ERRORS = (zlib.error, OSError, EOFError, ValueError, lzma.LZMAError, RuntimeError)
+
+
+def formats():
+    """
+    Return the names of the formats that can be decompressed here.
+    """
+    return [name for name, _, decompress in FORMATS if decompress is not None]
+
+
+def match(head):
+    """
+    Return the decompress function for the format `head` starts with, or
+    None if it isn't a supported compressed format.
+    """
+    for _, test, decompress in FORMATS:
+        if decompress is not None and test(head):
+            return decompress
+    return None
+
+
+def decompress(data, limit):
+    """
+    Return up to `limit` bytes decompressed from the start of `data`, or
+    None if it isn't compressed in a supported format or is corrupt.
+    `data` may be truncated; what can be decompressed from it is.
+    """
+    fn = match(bytes(data[:HEAD_BYTES]))
+    if fn is None:
+        return None
+    try:
+        return fn(data, limit)
+    except _ERRORS:
+        return None
+
+
+def combine(flags, inner, outer):
+    """
+    Format libmagic's result for the decompressed data, `inner`, and for
+    the compressed data as it does under MAGIC_COMPRESS.  `outer` is a
+    function returning the latter, only called if it is needed.
+    """
+    from magic import MAGIC_MIME_ENCODING, MAGIC_MIME_TYPE
+
+    mime = flags & (MAGIC_MIME_TYPE | MAGIC_MIME_ENCODING)
+    if mime == MAGIC_MIME_TYPE | MAGIC_MIME_ENCODING:
+        return inner + b" compressed-encoding=" + outer()
+    if mime:
+        return inner
+    return inner + b" (" + outer() + b")"
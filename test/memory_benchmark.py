@@ -0,0 +1,55 @@
+"""
+Measure how much resident memory each additional cookie costs, with and
+without a shared database.
+
+    python test/memory_benchmark.py [cookies]
+
+Each mode runs in its own process so they don't disturb each other.
+Needs Linux, since RSS is read from /proc.
+"""
+
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+PDF = os.path.join(HERE, "testdata", "test.pdf")
+
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def measure(shared, count):
+    import magic
+
+    cookies = [magic.Magic(shared_database=shared)]
+    cookies[0].from_file(PDF)
+    before = rss()
+    for _ in range(count):
+        m = magic.Magic(shared_database=shared)
+        # touch the database the way a real call would
+        m.from_file(PDF)
+        cookies.append(m)
+    return (rss() - before) / count
+
+
+def main():
+    if len(sys.argv) > 2:
+        shared = sys.argv[2] == "shared"
+        print(measure(shared, int(sys.argv[1])))
+        return
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for mode in ("private", "shared"):
+        out = subprocess.check_output(
+            [sys.executable, __file__, str(count), mode], universal_newlines=True
+        )
+        print("%-8s %8.1f KiB RSS per additional cookie" % (mode, float(out) / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ from enum import Enum
 import os
 import os.path
 import shutil
+import sqlite3
 import sys
 import tempfile
 from typing import List, Union
@@ -191,6 +192,34 @@ class MagicTest(unittest.TestCase):
         except NotImplementedError:
             pass
 
+    def test_lazy_imports(self):
+        import subprocess
+
+        code = (
+            "import sys, magic; "
+            "print(sorted(m for m in ('magic.compat', 'magic.scan', 'ctypes.util', 'logging') "
+            "if m in sys.modules))"
+        )
+        out = subprocess.check_output([sys.executable, "-c", code])
+        self.assertEqual(out.strip(), b"[]")
+
+        self.assertEqual(magic.NONE, magic.MAGIC_NONE)
+        self.assertTrue(callable(magic.detect_from_content))
+        self.assertRaises(AttributeError, getattr, magic, "NOT_A_CONSTANT")
+
+    def test_library_override(self):
+        import subprocess
+
+        env = dict(os.environ, PYTHON_MAGIC_LIBRARY="/nonexistent/libmagic.so")
+        proc = subprocess.Popen(
+            [sys.executable, "-c", "import magic"],
+            env=env,
+            stderr=subprocess.PIPE,
+        )
+        _, err = proc.communicate()
+        self.assertNotEqual(proc.returncode, 0)
+        self.assertIn(b"/nonexistent/libmagic.so", err)
+
     def test_fs_encoding(self):
         self.assertEqual("utf-8", sys.getfilesystemencoding().lower())
 
@@ -289,6 +318,68 @@ class MagicTest(unittest.TestCase):
         with open(os.path.join(self.TESTDATA_DIR, "name_use.jpg"), "rb") as f:
             m.from_buffer(f.read())
 
+    def test_compile_cache(self):
+        from magic.database import compile_cached
+
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "hello.magic")
+            with open(source, "w") as f:
+                f.write("0\tstring\tHELLOMAGIC\tHello magic file\n!:mime\ttext/x-hello\n")
+            cache_dir = os.path.join(tmp, "cache")
+
+            m = magic.Magic(magic_file=source, compile_cache=cache_dir)
+            self.assertEqual(m.from_buffer(b"HELLOMAGIC"), "Hello magic file")
+            compiled = os.listdir(cache_dir)
+            self.assertEqual(len(compiled), 1)
+            self.assertTrue(compiled[0].endswith(".mgc"))
+
+            compiled = os.path.join(cache_dir, compiled[0])
+            self.assertEqual(compile_cached(source, cache_dir), compiled)
+            # already compiled files and directories are left alone
+            self.assertEqual(compile_cached(compiled, cache_dir), compiled)
+            self.assertEqual(compile_cached(tmp, cache_dir), tmp)
+
+            m = magic.Magic(magic_file=source, mime=True, compile_cache=cache_dir)
+            self.assertEqual(m.from_buffer(b"HELLOMAGIC"), "text/x-hello")
+
+    @unittest.skipIf(not magic._has_load_buffers, "magic_load_buffers not available")
+    def test_shared_database(self):
+        from magic.database import SharedDatabase
+
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+        db = SharedDatabase.get()
+        self.assertIs(SharedDatabase.get(), db)
+        self.assertGreater(db.size, 0)
+
+        m1 = magic.Magic(shared_database=True, mime=True)
+        m2 = magic.Magic(shared_database=db)
+        self.assertIs(m1._database, db)
+        self.assertEqual(m1.from_file(pdf), "application/pdf")
+        self.assertEqual(m2.from_file(pdf), magic.Magic().from_file(pdf))
+        self.assertEqual(m2.detect(pdf).mime_type, "application/pdf")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "hello.magic")
+            with open(source, "w") as f:
+                f.write("0\tstring\tHELLOMAGIC\tHello magic file\n")
+            os.environ["PYTHON_MAGIC_CACHE_DIR"] = os.path.join(tmp, "cache")
+            try:
+                m = magic.Magic(magic_file=source, shared_database=True)
+                self.assertEqual(m.from_buffer(b"HELLOMAGIC"), "Hello magic file")
+                self.assertRaises(ValueError, SharedDatabase, source, compile=False)
+            finally:
+                del os.environ["PYTHON_MAGIC_CACHE_DIR"]
+
+    def test_warmup(self):
+        pool = magic.MagicPool(size=2, mime=True)
+        self.assertIsNone(magic.warmup(mime=[True], count=2, pools=[pool], block=True))
+        self.assertEqual(len(pool._idle), 2)
+        self.assertGreaterEqual(len(magic._get_magic_type(True)._idle), 1)
+
+        thread = magic.warmup(mime=[False])
+        thread.join()
+        self.assertGreaterEqual(magic._get_magic_type(False)._created, 1)
+
     def test_pathlike(self):
         if sys.version_info < (3, 6):
             return
@@ -346,6 +437,966 @@ class MagicTest(unittest.TestCase):
         self.assertEqual(len(results), 100)
         self.assertTrue(all(r == "application/pdf" for r in results))
 
+    def test_file_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "f")
+            with open(path, "wb") as f:
+                f.write(b"%PDF-1.2")
+
+            m = magic.Magic(mime=True, file_cache=2)
+            self.assertEqual(m.from_file(path), "application/pdf")
+            self.assertEqual(m.from_file(path), "application/pdf")
+            self.assertEqual(m.file_cache_info(), magic.CacheInfo(1, 1, 2, 1))
+
+            # a change in size or mtime is a miss
+            with open(path, "wb") as f:
+                f.write(b"hello world\n")
+            self.assertEqual(m.from_file(path), "text/plain")
+            self.assertEqual(m.file_cache_info().misses, 2)
+
+            m.invalidate_file_cache(path)
+            self.assertEqual(m.file_cache_info().currsize, 1)
+            m.invalidate_file_cache()
+            self.assertEqual(m.file_cache_info(), magic.CacheInfo(0, 0, 2, 0))
+
+            # results made under other params aren't reused
+            try:
+                m.setparam(magic.MAGIC_PARAM_NAME_MAX, 1)
+            except NotImplementedError:
+                return
+            m.from_file(path)
+            m.setparam(magic.MAGIC_PARAM_NAME_MAX, 2)
+            m.from_file(path)
+            self.assertEqual(m.file_cache_info().hits, 0)
+
+        self.assertIsNone(magic.Magic().file_cache_info())
+
+    def test_file_cache_before_read(self):
+        # a cached file isn't opened again, even for the fast path
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+        m = magic.Magic(mime=True, fast_path=True, file_cache=2)
+        self.assertEqual(m.from_file(pdf), "application/pdf")
+
+        opened = []
+        old = os.open
+        os.open = lambda *args: opened.append(args) or old(*args)
+        try:
+            self.assertEqual(m.from_file(pdf), "application/pdf")
+        finally:
+            os.open = old
+        self.assertEqual(opened, [])
+        self.assertEqual(m.file_cache_info().hits, 1)
+
+    def test_buffer_protocol(self):
+        import array
+        import mmap
+
+        m = magic.Magic(mime=True)
+        with open(os.path.join(self.TESTDATA_DIR, "test.pdf"), "rb") as f:
+            data = f.read()
+
+        self.assertEqual(m.from_buffer(bytearray(data)), "application/pdf")
+        self.assertEqual(m.from_buffer(memoryview(data)[:100]), "application/pdf")
+        self.assertEqual(m.from_buffer(memoryview(bytearray(data))), "application/pdf")
+        self.assertEqual(m.from_buffer(array.array("B", data)), "application/pdf")
+        self.assertEqual(m.from_buffer(bytearray()), "application/x-empty")
+
+        mm = mmap.mmap(-1, len(data))
+        mm.write(data)
+        self.assertEqual(m.from_buffer(mm), "application/pdf")
+        mm.close()
+
+    def test_buffer_truncation(self):
+        m = magic.Magic()
+        try:
+            m.setparam(magic.MAGIC_PARAM_BYTES_MAX, 64)
+        except NotImplementedError:
+            return
+        data = b"hello world " * 10 + b"\x00\x01\x02\xff" * 100
+        self.assertEqual(m.from_buffer(data), m.from_buffer(data[:64]))
+        self.assertEqual(m.from_buffer(bytearray(data)), m.from_buffer(data[:64]))
+        self.assertEqual(
+            m.from_buffer(data.decode("latin-1")), m.from_buffer(data[:64].decode("latin-1"))
+        )
+        self.assertEqual(len(magic._buffer_view(data, 64)), 64)
+        self.assertEqual(bytes(magic._buffer_view(bytearray(data), 64)), data[:64])
+
+    def test_buffer_strided(self):
+        import array
+
+        m = magic.Magic(mime=True)
+        self.assertEqual(
+            m.from_buffer(memoryview(bytearray(b"%%PPDDFF--11..22"))[::2]), "application/pdf"
+        )
+        data = array.array("B", b"%%PPDDFF--11..22" + b"\n" * 100000)
+        self.assertEqual(m.from_buffer(memoryview(data)[::2]), "application/pdf")
+
+        # only the prefix is copied
+        view = memoryview(bytearray(b"%PDF-1.2 " * 1000)).cast("B", (1000, 9))[::2]
+        self.assertEqual(len(magic._buffer_view(view, 20)), 20)
+        self.assertEqual(len(magic._buffer_view(view)), 4500)
+
+    def test_buffer_truncation_str(self):
+        # the encoded str is a temporary that must outlive the libmagic call
+        m = magic.Magic()
+        limit = m._bytes_max or magic._DEFAULT_BYTES_MAX
+        text = "\u00e9" * limit
+        expected = m.from_buffer(text.encode("utf-8")[:limit])
+        self.assertEqual(m.from_buffer(text), expected)
+        self.assertEqual(list(m.from_buffers([text, text])), [expected, expected])
+
+    def test_from_stream(self):
+        import io
+
+        m = magic.Magic(mime=True)
+        with open(os.path.join(self.TESTDATA_DIR, "test.pdf"), "rb") as f:
+            data = f.read()
+
+        stream = io.BytesIO(b"xx" + data)
+        stream.seek(2)
+        self.assertEqual(m.from_stream(stream), "application/pdf")
+        self.assertEqual(stream.tell(), 2)
+
+        class Chunked(object):
+            # non-seekable, no readinto, short reads
+            def __init__(self, data):
+                self.data = data
+
+            def read(self, n):
+                chunk, self.data = self.data[:min(n, 7)], self.data[min(n, 7):]
+                return chunk
+
+        self.assertEqual(m.from_stream(Chunked(data)), "application/pdf")
+        self.assertEqual(m.from_stream(io.BytesIO()), "application/x-empty")
+
+        try:
+            m.setparam(magic.MAGIC_PARAM_BYTES_MAX, 16)
+        except NotImplementedError:
+            return
+        stream = Chunked(data)
+        m.from_stream(stream)
+        self.assertEqual(stream.data, data[16:])
+
+    def test_detect(self):
+        import io
+
+        m = magic.Magic()
+        fields = ("mime_type", "encoding", "name")
+        for name in ["test.pdf", "test.gz", "elf-NetBSD-x86_64-echo", "text.txt"]:
+            path = os.path.join(self.TESTDATA_DIR, name)
+            expected = magic.Detection(
+                mime_type=magic.Magic(mime=True).from_file(path),
+                encoding=magic.Magic(mime_encoding=True).from_file(path),
+                name=magic.Magic().from_file(path),
+            )
+            self.assertEqual(m.detect(path, fields), expected)
+            with open(path, "rb") as f:
+                self.assertEqual(m.detect(f.fileno(), fields), expected)
+                f.seek(3)
+                m.detect(f.fileno(), fields)
+                self.assertEqual(f.tell(), 3)
+
+        with open(os.path.join(self.TESTDATA_DIR, "test.pdf"), "rb") as f:
+            data = f.read()
+        result = m.detect(data, fields=("mime_type", "extension"))
+        self.assertEqual(result.mime_type, "application/pdf")
+        self.assertIsNone(result.encoding)
+        self.assertIsNone(result.name)
+        self.assertEqual(m.detect(io.BytesIO(data), fields=("encoding",)).encoding, "us-ascii")
+
+        self.assertRaises(ValueError, m.detect, data, fields=("bogus",))
+        self.assertRaises(IOError, m.detect, "nonexistent")
+
+    def test_buffer_cache(self):
+        m = magic.Magic(mime=True, cache=16)
+        self.assertEqual(m.from_buffer(b"%PDF-1.2 a"), "application/pdf")
+        self.assertEqual(m.from_buffer(b"%PDF-1.2 a"), "application/pdf")
+        self.assertEqual(m.from_buffer(b"hello\n"), "text/plain")
+        self.assertEqual(m.cache_info(), magic.CacheInfo(1, 2, 16, 2))
+
+        try:
+            m.setparam(magic.MAGIC_PARAM_BYTES_MAX, 8)
+        except NotImplementedError:
+            return
+        # only the first 8 bytes are examined, so these share an entry
+        self.assertEqual(m.from_buffer(b"%PDF-1.2 b"), "application/pdf")
+        self.assertEqual(m.from_buffer(b"%PDF-1.2 c"), "application/pdf")
+        self.assertEqual(m.cache_info().hits, 2)
+
+        # other params have their own entries
+        m.setparam(magic.MAGIC_PARAM_NAME_MAX, 1)
+        m.from_buffer(b"%PDF-1.2 d")
+        self.assertEqual(m.cache_info().hits, 2)
+
+        m = magic.Magic(uncompress=True, cache=16)
+        m.setparam(magic.MAGIC_PARAM_BYTES_MAX, 8)
+        m.from_buffer(b"%PDF-1.2 a")
+        self.assertEqual(m.cache_info().currsize, 0)
+        m.cache_clear()
+
+    def test_batch(self):
+        m = magic.Magic(mime=True)
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+
+        results = list(m.from_buffers([b"%PDF-1.2", "hello\n"] * 100, chunk_size=7))
+        self.assertEqual(results, ["application/pdf", "text/plain"] * 100)
+
+        results = list(m.from_files([pdf, "nonexistent", pdf]))
+        self.assertEqual(results[0], "application/pdf")
+        self.assertIsInstance(results[1], OSError)
+        self.assertEqual(results[2], "application/pdf")
+
+        with open(pdf, "rb") as f:
+            self.assertEqual(list(m.from_descriptors([f.fileno()])), ["application/pdf"])
+
+    def test_batch_caches(self):
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+        text = os.path.join(self.TESTDATA_DIR, "text.txt")
+
+        m = magic.Magic(mime=True, file_cache=8)
+        self.assertEqual(list(m.from_files([pdf])), ["application/pdf"])
+        self.assertEqual(list(m.from_files([pdf, pdf])), ["application/pdf"] * 2)
+        self.assertEqual(m.file_cache_info(), magic.CacheInfo(2, 1, 8, 1))
+
+        m = magic.Magic(mime=True, cache=8)
+        self.assertEqual(list(m.from_buffers([b"%PDF-1.2"])), ["application/pdf"])
+        self.assertEqual(
+            list(m.from_buffers([b"%PDF-1.2", "hello\n"])),
+            ["application/pdf", "text/plain"],
+        )
+        self.assertEqual(m.cache_info(), magic.CacheInfo(1, 2, 8, 2))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "index.db")
+            expected = ["application/pdf", "text/plain"]
+            m = magic.Magic(mime=True, index=db)
+            self.assertEqual(list(m.from_files([pdf, text])), expected)
+
+            # answered from the index without calling libmagic
+            old = magic._magic_file_unchecked
+            magic._magic_file_unchecked = None
+            try:
+                self.assertEqual(list(m.from_files([pdf, text])), expected)
+            finally:
+                magic._magic_file_unchecked = old
+            m._index.close()
+
+    def test_batch_errors(self):
+        old = magic._magic_buffer_unchecked
+        try:
+            magic._magic_buffer_unchecked = lambda cookie, buf, n: None
+
+            results = list(magic.Magic().from_buffers([b"x"]))
+            self.assertIsInstance(results[0], magic.MagicException)
+
+            results = list(magic.Magic(mime=True).from_buffers([b"x"]))
+            self.assertEqual(results, ["application/octet-stream"])
+        finally:
+            magic._magic_buffer_unchecked = old
+
+    def test_stats(self):
+        from magic.stats import Hooks
+
+        plain = magic.Magic()
+        self.assertIsNone(plain.stats())
+        self.assertIs(type(plain), magic.Magic)
+        # the instance isn't referenced once from_buffer has been looked up
+        self.assertEqual(
+            magic.Magic(mime=True, stats=True).from_buffer(b"%PDF-1.2"), "application/pdf"
+        )
+
+        calls = []
+
+        class Recorder(Hooks):
+            def before(self, method, source):
+                return method
+
+            def after(self, method, source, result, error, seconds, token):
+                calls.append((method, result, type(error), token))
+
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+        m = magic.Magic(mime=True, stats=True, hooks=[Recorder()])
+        self.assertEqual(m.from_file(pdf), "application/pdf")
+        with open(pdf, "rb") as f:
+            self.assertEqual(m.from_stream(f), "application/pdf")
+        self.assertRaises(OSError, m.from_file, "nonexistent")
+        self.assertEqual(list(m.from_buffers([b"%PDF-1.2", b"x"]))[0], "application/pdf")
+
+        # from_stream's inner from_buffer isn't reported separately
+        self.assertEqual(
+            calls,
+            [
+                ("from_file", "application/pdf", type(None), "from_file"),
+                ("from_stream", "application/pdf", type(None), "from_stream"),
+                ("from_file", None, FileNotFoundError, "from_file"),
+            ],
+        )
+
+        stats = m.stats(reset=True)
+        self.assertEqual(
+            stats["calls"], {"from_file": 2, "from_stream": 1, "from_buffers": 2}
+        )
+        self.assertEqual(stats["errors"], {"from_file": 1})
+        size = os.path.getsize(pdf)
+        self.assertEqual(stats["bytes"], 2 * size + len(b"%PDF-1.2x"))
+        self.assertEqual(stats["call_time"]["count"], 3)
+        self.assertEqual(stats["lock_hold"]["count"], 3)
+        self.assertEqual(m.stats()["calls"], {})
+
+        old = magic._magic_buffer_unchecked
+        try:
+            magic._magic_buffer_unchecked = lambda cookie, buf, n: None
+            list(m.from_buffers([b"x"]))
+        finally:
+            magic._magic_buffer_unchecked = old
+        self.assertEqual(m.stats()["fallbacks"], 1)
+
+        # calls with flag overrides are counted too
+        m.stats(reset=True)
+        self.assertEqual(
+            m.from_buffer(b"%PDF-1.2", mime_encoding=True), "application/pdf; charset=us-ascii"
+        )
+        self.assertEqual(m.stats()["calls"], {"from_buffer": 1})
+        self.assertEqual(m.stats()["bytes"], len(b"%PDF-1.2"))
+
+    def test_profile_checks(self):
+        from magic.tune import profile_checks
+
+        corpus = [
+            os.path.join(self.TESTDATA_DIR, name)
+            for name in ("test.pdf", "test.gz", "lambda")
+        ] + [b"%PDF-1.2", b"hello world\n"]
+        result = profile_checks(
+            corpus,
+            repeat=1,
+            checks=("check_tar", "check_text"),
+            mime=True,
+            check_json=False,
+        )
+        self.assertEqual(set(result.checks), {"check_tar", "check_text"})
+        # plain text is only recognised by the text checks
+        self.assertGreater(result.checks["check_text"].changed, 0)
+        self.assertEqual(result.kwargs["check_json"], False)
+        self.assertNotIn("check_text", result.kwargs)
+
+        m = magic.Magic(**result.kwargs)
+        base = magic.Magic(mime=True, check_json=False)
+        for item in corpus:
+            self.assertEqual(m.detect(item, ["mime_type"]), base.detect(item, ["mime_type"]))
+
+    def test_fast_path(self):
+        import io
+        import zipfile
+
+        self.assertRaises(ValueError, magic.Magic, fast_path=True)
+        self.assertRaises(
+            ValueError, magic.Magic, mime=True, mime_encoding=True, fast_path=True
+        )
+
+        m = magic.Magic(mime=True, fast_path=True)
+        ref = magic.Magic(mime=True)
+        for name in os.listdir(self.TESTDATA_DIR):
+            path = os.path.join(self.TESTDATA_DIR, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            self.assertEqual(m.from_file(path), ref.from_file(path), name)
+            self.assertEqual(m.from_buffer(data), ref.from_buffer(data), name)
+
+        def zipped(name):
+            out = io.BytesIO()
+            with zipfile.ZipFile(out, "w") as z:
+                z.writestr(name, b"x" * 100)
+            return out.getvalue()
+
+        self.assertIsNotNone(m._fast_path.lookup(zipped("a.txt")))
+        # OOXML etc are left to libmagic
+        self.assertIsNone(m._fast_path.lookup(zipped("[Content_Types].xml")))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            link = os.path.join(tmp, "link")
+            os.symlink(os.path.join(self.TESTDATA_DIR, "test.pdf"), link)
+            self.assertEqual(m.from_file(link), "inode/symlink")
+
+        # a signature that disagrees with libmagic is disabled
+        v = magic.Magic(mime=True, fast_path=True, fast_path_verify=1)
+        v._fast_path.lookup(b"%PDF-1.2").result = "application/x-wrong"
+        self.assertEqual(v.from_buffer(b"%PDF-1.2"), "application/pdf")
+        self.assertIn("pdf", v._fast_path.disabled)
+        self.assertNotIn("pdf", v._fast_path.signatures())
+        self.assertEqual(v.from_buffer(b"%PDF-1.2"), "application/pdf")
+
+    def test_result_type(self):
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+        self.assertRaises(ValueError, magic.Magic, result_type="unicode")
+
+        m = magic.Magic(mime=True, result_type="bytes")
+        self.assertEqual(m.from_file(pdf), b"application/pdf")
+        self.assertEqual(m.from_buffer(b"%PDF-1.2"), b"application/pdf")
+        self.assertIsNone(m.result_names())
+
+        m = magic.Magic(mime=True, intern_results=True)
+        first = m.from_buffer(b"%PDF-1.2")
+        self.assertEqual(first, "application/pdf")
+        self.assertIs(m.from_file(pdf), first)
+
+        m = magic.Magic(mime=True, result_type="id")
+        pdf_id = m.from_file(pdf)
+        self.assertIsInstance(pdf_id, int)
+        self.assertEqual(m.from_buffer(b"%PDF-1.2"), pdf_id)
+        text_id = m.from_buffer(b"hello world\n")
+        self.assertNotEqual(text_id, pdf_id)
+        self.assertEqual(list(m.from_buffers([b"%PDF-1.2"])), [pdf_id])
+        names = m.result_names()
+        self.assertEqual(names[pdf_id], "application/pdf")
+        self.assertEqual(names[text_id], "text/plain")
+
+        d = m.detect(pdf, ["mime_type", "encoding"])
+        self.assertEqual(d.mime_type, pdf_id)
+        self.assertEqual(m.result_names()[d.encoding], "us-ascii")
+
+        fast = magic.Magic(mime=True, result_type="id", fast_path=True)
+        self.assertEqual(fast.result_names()[fast.from_file(pdf)], "application/pdf")
+
+    def test_cli(self):
+        import json
+        import subprocess
+
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+        text = os.path.join(self.TESTDATA_DIR, "text.txt")
+
+        def run(args, stdin=b""):
+            proc = subprocess.run(
+                [sys.executable, "-m", "magic"] + args,
+                input=stdin,
+                stdout=subprocess.PIPE,
+            )
+            return proc.returncode, proc.stdout.decode("utf-8")
+
+        code, out = run(["-k", pdf, "nonexistent", text])
+        self.assertEqual(code, 1)
+        records = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual([r["path"] for r in records], [pdf, "nonexistent", text])
+        self.assertEqual(records[0]["mime_type"], "application/pdf")
+        self.assertEqual(records[0]["encoding"], "us-ascii")
+        self.assertTrue(records[0]["description"].startswith("PDF document"))
+        self.assertIn("error", records[1])
+
+        code, out = run(["-0", "--tsv"], (pdf + "\0" + text + "\0").encode())
+        self.assertEqual(code, 0)
+        rows = sorted(line.split("\t") for line in out.splitlines())
+        self.assertEqual([r[:2] for r in rows], [[pdf, "application/pdf"], [text, "text/plain"]])
+
+        # paths that aren't valid UTF-8 are written as they are
+        with tempfile.TemporaryDirectory() as tmp:
+            name = os.path.join(os.fsencode(tmp), b"caf\xe9.txt")
+            with open(name, "wb") as f:
+                f.write(b"hello\n")
+            proc = subprocess.run(
+                [sys.executable, "-m", "magic", "--tsv", os.fsdecode(name)],
+                stdout=subprocess.PIPE,
+                env=dict(os.environ, PYTHONIOENCODING="utf-8:strict"),
+            )
+            self.assertEqual(proc.returncode, 0)
+            self.assertEqual(proc.stdout.split(b"\t")[:2], [name, b"text/plain"])
+
+    def test_bench(self):
+        import json
+        from magic import bench
+
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = bench.make_corpus(self.TESTDATA_DIR, tmp, 6)
+            self.assertEqual(len(paths), 6)
+            results = bench.run(paths, bench.METHODS, ["mime"], threads=[2], processes=[2])
+            self.assertEqual(len(results), len(bench.METHODS) * 2)
+            for result in results:
+                self.assertEqual(result["calls"], 6)
+                self.assertGreater(result["seconds"], 0)
+
+            out = os.path.join(tmp, "out.json")
+            bench.main(
+                ["--seeds", self.TESTDATA_DIR, "--files", "2", "--methods", "from_file"]
+                + ["--presets", "plain", "--threads", "1", "-o", out]
+            )
+            with open(out) as f:
+                self.assertEqual(len(json.load(f)["results"]), 1)
+
+        # there's no corpus to fall back on outside a source checkout
+        with self.assertRaises(SystemExit):
+            bench.main(["--seeds", os.path.join(self.TESTDATA_DIR, "nonexistent")])
+
+    def test_pickle(self):
+        import copy
+        import pickle
+
+        m = magic.Magic(mime=True)
+        m.setparam(magic.MAGIC_PARAM_BYTES_MAX, 4096)
+        data = pickle.dumps(m)
+
+        # a copy in the same process is a new instance
+        c = pickle.loads(data)
+        self.assertIsNot(c, m)
+        self.assertIsNot(copy.deepcopy(m), c)
+        self.assertEqual(c.getparam(magic.MAGIC_PARAM_BYTES_MAX), 4096)
+        self.assertEqual(c.from_buffer(b"%PDF-1.2"), "application/pdf")
+
+        # another process builds each pickled instance once
+        key = (m._pickle_key[0] + 1,) + m._pickle_key[1:]
+        args = (key, m._args, m._params)
+        try:
+            self.assertIs(magic._rebuild(*args), magic._rebuild(*args))
+        finally:
+            magic._rebuilt.discard(key)
+
+        # but only keeps the most recent few
+        keys = [(key[0], "other", i) for i in range(magic._REBUILT_MAX + 1)]
+        try:
+            first = magic._rebuild(keys[0], m._args, m._params)
+            for k in keys[1:]:
+                magic._rebuild(k, m._args, m._params)
+            self.assertIsNot(magic._rebuild(keys[0], m._args, m._params), first)
+        finally:
+            for k in keys:
+                magic._rebuilt.discard(k)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs fork")
+    def test_fork(self):
+        from magic.index import Index
+
+        m = magic.Magic(mime=True, stats=True)
+        pool = magic.MagicPool(size=1, mime=True)
+        entry = pool._acquire()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+
+        # fork while other threads would be inside libmagic and opening
+        # an index
+        m.lock.acquire()
+        Index._instances_lock.acquire()
+        try:
+            pid = os.fork()
+            if pid == 0:
+                ok = False
+                try:
+                    Index.get(os.path.join(tmp, "index.db"))
+                    ok = (
+                        m.from_buffer(b"%PDF-1.2") == "application/pdf"
+                        and pool.from_buffer(b"%PDF-1.2") == "application/pdf"
+                        and magic.from_buffer(b"%PDF-1.2", mime=True) == "application/pdf"
+                    )
+                finally:
+                    os._exit(0 if ok else 1)
+        finally:
+            Index._instances_lock.release()
+            m.lock.release()
+            pool._release(entry)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+
+    def test_index(self):
+        from magic.index import Index
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "index.db")
+            path = os.path.join(tmp, "file")
+            with open(path, "wb") as f:
+                f.write(b"%PDF-1.2")
+
+            m = magic.Magic(mime=True, index=db)
+            self.assertIs(m._index, Index.get(db))
+            self.assertEqual(m.from_file(path), "application/pdf")
+
+            # answered from the index without calling libmagic
+            old = magic._magic_file
+            magic._magic_file = None
+            try:
+                self.assertEqual(
+                    magic.Magic(mime=True, index=db).from_file(path), "application/pdf"
+                )
+            finally:
+                magic._magic_file = old
+
+            # other flags have their own entries
+            self.assertEqual(
+                magic.Magic(index=db).from_file(path), "PDF document, version 1.2"
+            )
+
+            # changed files are identified again
+            with open(path, "wb") as f:
+                f.write(b"hello world, this is longer\n")
+            self.assertEqual(m.from_file(path), "text/plain")
+
+            # several processes can share the index
+            paths = [os.path.join(self.TESTDATA_DIR, "test.pdf"), path] * 4
+            results = list(magic.identify_many(paths, workers=2, mime=True, index=db))
+            self.assertEqual(results, ["application/pdf", "text/plain"] * 4)
+
+            os.remove(path)
+            index = Index.get(db)
+            index.compact()
+            conn = index._conn()
+            stored = [os.fsdecode(p) for (p,) in conn.execute("SELECT path FROM results")]
+            self.assertEqual(stored, [os.path.join(self.TESTDATA_DIR, "test.pdf")])
+
+            index.compact(max_age=-1)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM results").fetchone()[0], 0)
+            index.close()
+
+            self.assertRaises(ValueError, magic.Magic, index=db, result_type="id")
+
+    def test_index_compact_keeps_hits(self):
+        # a rescan where nothing changed only looks results up, and its
+        # configuration must survive compaction
+        from magic.index import Index
+
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "index.db")
+            magic.Magic(mime=True, index=db).from_file(pdf)
+
+            def backdate():
+                with sqlite3.connect(db) as conn:
+                    conn.execute("UPDATE configs SET last_used = last_used - 31 * 86400")
+
+            def count(index):
+                return index._conn().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+            # in the same process
+            backdate()
+            m = magic.Magic(mime=True, index=db)
+            self.assertEqual(m.from_file(pdf), "application/pdf")
+            m._index.compact()
+            self.assertEqual(count(m._index), 1)
+
+            # and in a later one, which only has hits
+            backdate()
+            index = Index(db)
+            m = magic.Magic(mime=True, index=index)
+            self.assertEqual(m.from_file(pdf), "application/pdf")
+            index.compact()
+            self.assertEqual(count(index), 1)
+            index.close()
+            Index.get(db).close()
+
+    def test_identify_many(self):
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+        items = [pdf, b"%PDF-1.2", "nonexistent", b"hello\n"] * 5
+
+        results = list(magic.identify_many(items, workers=2, chunksize=3, mime=True))
+        self.assertEqual(len(results), len(items))
+        self.assertEqual(results[:2], ["application/pdf", "application/pdf"])
+        self.assertIsInstance(results[2], OSError)
+        self.assertEqual(results[3], "text/plain")
+
+        unordered = dict(magic.identify_many(items, workers=2, ordered=False, mime=True))
+        self.assertEqual(sorted(unordered), list(range(len(items))))
+        self.assertEqual(unordered[7], "text/plain")
+
+    def test_prefetch_files(self):
+        names = sorted(os.listdir(self.TESTDATA_DIR))
+        paths = [os.path.join(self.TESTDATA_DIR, n) for n in names]
+        paths += ["nonexistent", self.TESTDATA_DIR]
+
+        for kwargs in ({}, {"mime": True}):
+            m = magic.Magic(**kwargs)
+            results = list(magic.prefetch_files(paths, io_depth=3, match_workers=2, **kwargs))
+            self.assertEqual(len(results), len(paths))
+            self.assertIsInstance(results[-2], OSError)
+            # the same as from_file, including ELF and gzip whose details
+            # come from past the prefix
+            for path, result in zip(paths, results):
+                if path != "nonexistent":
+                    self.assertEqual(result, m.from_file(path))
+
+        self.assertRaises(ValueError, list, magic.prefetch_files(paths, io_depth=0))
+
+    def test_prefetch_files_zip_trailer(self):
+        # a zip with data prepended is only recognised from its end
+        import zipfile
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sfx.zip")
+            with open(path, "wb") as f:
+                f.write(b"\x00junk" * 4096)
+                with zipfile.ZipFile(f, "a") as z:
+                    z.writestr("a.txt", "hello")
+            for kwargs in ({}, {"mime": True}, {"keep_going": True}):
+                expected = magic.Magic(**kwargs).from_file(path)
+                results = list(magic.prefetch_files([path], **kwargs))
+                self.assertEqual(results, [expected])
+            self.assertIn("Zip archive", magic.Magic().from_file(path))
+
+    def test_from_archive(self):
+        import io
+        import tarfile
+        import zipfile
+
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+        text = os.path.join(self.TESTDATA_DIR, "text.txt")
+        with tempfile.TemporaryDirectory() as tmp:
+            inner = os.path.join(tmp, "inner.tar.gz")
+            with tarfile.open(inner, "w:gz") as t:
+                t.add(pdf, "docs/test.pdf")
+                t.add(text, "text.txt")
+            outer = os.path.join(tmp, "outer.zip")
+            with zipfile.ZipFile(outer, "w", zipfile.ZIP_DEFLATED) as z:
+                z.write(pdf, "a.pdf")
+                z.write(inner, "nested/inner.tar.gz")
+                z.writestr("dir/", b"")
+                z.writestr("big.txt", b"hello\n" * 100000)
+
+            m = magic.Magic(mime=True)
+            self.assertEqual(
+                list(m.from_archive(outer)),
+                [
+                    ("a.pdf", "application/pdf"),
+                    ("nested/inner.tar.gz", "application/gzip"),
+                    ("nested/inner.tar.gz/docs/test.pdf", "application/pdf"),
+                    ("nested/inner.tar.gz/text.txt", "text/plain"),
+                    ("big.txt", "text/plain"),
+                ],
+            )
+            self.assertEqual(
+                [name for name, _ in m.from_archive(outer, max_depth=0)],
+                ["a.pdf", "nested/inner.tar.gz", "big.txt"],
+            )
+
+            # tars can be read from a stream that can't seek
+            with open(inner, "rb") as f:
+                data = f.read()
+            r, w = os.pipe()
+            os.write(w, data)
+            os.close(w)
+            with os.fdopen(r, "rb") as f:
+                self.assertEqual(
+                    list(m.from_archive(f)),
+                    [("docs/test.pdf", "application/pdf"), ("text.txt", "text/plain")],
+                )
+
+            self.assertRaises(ValueError, list, m.from_archive(pdf))
+            self.assertRaises(ValueError, list, m.from_archive(io.BytesIO(b"hello")))
+
+    def test_python_uncompress(self):
+        import bz2
+        import lzma
+
+        gz = os.path.join(self.TESTDATA_DIR, "test.gz")
+        with open(os.path.join(self.TESTDATA_DIR, "text.txt"), "rb") as f:
+            text = f.read()
+
+        for kwargs in ({}, {"mime": True}, {"mime": True, "mime_encoding": True}):
+            m = magic.Magic(uncompress=True, **kwargs)
+            py = magic.Magic(uncompress="python", **kwargs)
+            self.assertFalse(py.flags & magic.MAGIC_COMPRESS)
+            self.assertEqual(py.from_file(gz), m.from_file(gz))
+            with open(gz, "rb") as f:
+                self.assertEqual(py.from_descriptor(f.fileno()), m.from_file(gz))
+            for data in (bz2.compress(text), lzma.compress(text), text):
+                self.assertEqual(py.from_buffer(data), m.from_buffer(data))
+
+        py = magic.Magic(uncompress="python")
+        results = list(py.from_files([gz, "nonexistent"]))
+        self.assertEqual(results[0], magic.Magic(uncompress=True).from_file(gz))
+        self.assertIsInstance(results[1], OSError)
+        self.assertEqual(py.detect(gz, ("mime_type", "name")).mime_type, "text/plain")
+        self.assertRaises(
+            ValueError, magic.Magic, mime=True, uncompress="python", fast_path=True
+        )
+
+    def test_flag_overrides(self):
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+        gz = os.path.join(self.TESTDATA_DIR, "test.gz")
+
+        m = magic.Magic(file_cache=8, cache=8)
+        plain = magic.Magic().from_file(pdf)
+        for kwargs in (
+            {"mime": True},
+            {"mime": True, "mime_encoding": True},
+            {"uncompress": True},
+            {"uncompress": "python", "mime": True},
+            {"check_soft": False},
+        ):
+            expected = magic.Magic(**kwargs)
+            for path in (pdf, gz):
+                self.assertEqual(m.from_file(path, **kwargs), expected.from_file(path))
+                with open(path, "rb") as f:
+                    data = f.read()
+                self.assertEqual(m.from_buffer(data, **kwargs), expected.from_buffer(data))
+            # the same cookie, switched for the call and then restored
+            self.assertIs(m._with_flags(kwargs).cookie, m.cookie)
+            self.assertEqual(m.from_file(pdf), plain)
+        self.assertIs(m._with_flags({"mime": True}), m._with_flags({"mime": True}))
+        self.assertIs(m._with_flags({"mime": False}), m)
+
+        self.assertEqual(
+            m.detect(pdf, ("mime_type", "name"), check_soft=False).mime_type,
+            magic.Magic(check_soft=False).detect(pdf, ("mime_type",)).mime_type,
+        )
+        self.assertEqual(
+            list(m.from_files([pdf, "nonexistent"], mime=True))[0], "application/pdf"
+        )
+        self.assertRaises(TypeError, m.from_file, pdf, bogus=True)
+
+        self.assertEqual(
+            magic.from_file(pdf, mime=True, mime_encoding=True),
+            "application/pdf; charset=us-ascii",
+        )
+        self.assertIs(magic._get_magic_type(True), magic._get_magic_type(False))
+
+    def test_aio(self):
+        import asyncio
+        from magic.aio import AsyncMagic
+
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+
+        async def run():
+            async with AsyncMagic(max_concurrency=2, max_bytes=10, mime=True) as m:
+                results = await asyncio.gather(
+                    m.from_file(pdf),
+                    m.from_buffer(b"%PDF-1.2"),
+                    m.from_buffer(b"hello world\n" * 100, timeout=5),
+                )
+                with open(pdf, "rb") as f:
+                    results.append(await m.from_descriptor(f.fileno()))
+                with self.assertRaises(IOError):
+                    await m.from_file("nonexistent")
+                self.assertEqual(m._in_flight, 0)
+                return results
+
+        self.assertEqual(
+            asyncio.run(run()),
+            ["application/pdf", "application/pdf", "text/plain", "application/pdf"],
+        )
+
+    def test_aio_lazy(self):
+        import asyncio
+        from magic.aio import AsyncMagic
+
+        async def run():
+            # no cookie, and so no database load, on the event loop
+            m = AsyncMagic(max_concurrency=2, mime=True)
+            self.assertEqual(m._pool._created, 0)
+            try:
+                return await m.from_buffer(b"%PDF-1.2")
+            finally:
+                m.close()
+
+        self.assertEqual(asyncio.run(run()), "application/pdf")
+
+    def test_aio_dangling_symlink(self):
+        import asyncio
+        from magic.aio import AsyncMagic
+
+        with tempfile.TemporaryDirectory() as tmp:
+            link = os.path.join(tmp, "link")
+            os.symlink(os.path.join(tmp, "missing"), link)
+            expected = magic.Magic().from_file(link)
+
+            async def run():
+                async with AsyncMagic() as m:
+                    return await m.from_file(link, timeout=5)
+
+            self.assertEqual(asyncio.run(run()), expected)
+            self.assertIn("broken symbolic link", expected)
+
+    def test_scan_tree(self):
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "a", "b"))
+            os.makedirs(os.path.join(tmp, "skip"))
+            shutil.copyfile(pdf, os.path.join(tmp, "a", "b", "one.pdf"))
+            os.link(os.path.join(tmp, "a", "b", "one.pdf"), os.path.join(tmp, "a", "two.pdf"))
+            shutil.copyfile(pdf, os.path.join(tmp, "skip", "three.pdf"))
+            with open(os.path.join(tmp, "a", "notes.txt"), "w") as f:
+                f.write("hello\n")
+            os.symlink(os.path.join(tmp, "a"), os.path.join(tmp, "link"))
+
+            results = dict(magic.scan_tree(tmp, workers=2, exclude=["skip"], mime=True))
+            self.assertEqual(
+                results,
+                {
+                    os.path.join(tmp, "a", "b", "one.pdf"): "application/pdf",
+                    os.path.join(tmp, "a", "two.pdf"): "application/pdf",
+                    os.path.join(tmp, "a", "notes.txt"): "text/plain",
+                    os.path.join(tmp, "link"): "inode/symlink",
+                },
+            )
+
+            results = dict(
+                magic.scan_tree(
+                    tmp,
+                    include=["*.pdf"],
+                    follow_symlinks=True,
+                    per_device=1,
+                    mime=True,
+                )
+            )
+            # "a" is reached through either "a" or "link" but only walked once
+            self.assertEqual(
+                sorted(os.path.basename(p) for p in results),
+                ["one.pdf", "three.pdf", "two.pdf"],
+            )
+            self.assertEqual(set(results.values()), set(["application/pdf"]))
+
+    def test_scan_tree_symlink_root(self):
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "a"))
+            shutil.copyfile(pdf, os.path.join(tmp, "a", "one.pdf"))
+            link = os.path.join(tmp, "link")
+            os.symlink(os.path.join(tmp, "a"), link)
+
+            # the root is a link like any other unless links are followed
+            results = dict(magic.scan_tree(link, mime=True))
+            self.assertEqual(list(results), [link])
+            self.assertEqual(results[link], "inode/symlink")
+            results = dict(magic.scan_tree(link, follow_symlinks=True, mime=True))
+            self.assertEqual(list(results), [os.path.join(link, "one.pdf")])
+
+    def test_scan_tree_per_device(self):
+        pdf = os.path.join(self.TESTDATA_DIR, "test.pdf")
+        with tempfile.TemporaryDirectory() as tmp:
+            for i in range(20):
+                shutil.copyfile(pdf, os.path.join(tmp, "%d.pdf" % i))
+
+            # files over the limit wait for their device's slot to free
+            results = list(magic.scan_tree(tmp, workers=4, per_device=1, mime=True))
+            self.assertEqual(len(results), 20)
+            self.assertEqual(set(r for _, r in results), set(["application/pdf"]))
+
+            # closing the scan early drops the files still waiting
+            it = magic.scan_tree(tmp, workers=4, per_device=2, mime=True)
+            self.assertEqual(next(it)[1], "application/pdf")
+            it.close()
+
+    @unittest.skipIf(not HAS_CONCURRENT_FUTURES, "concurrent.futures not available in Python 2.7")
+    def test_pool(self):
+        filename = os.path.join(self.TESTDATA_DIR, "test.pdf")
+
+        pool = magic.MagicPool(size=4, mime=True)
+
+        def check_file(_):
+            return pool.from_file(filename)
+
+        with ThreadPoolExecutor(16) as executor:
+            results = list(executor.map(check_file, range(100)))
+
+        self.assertTrue(all(r == "application/pdf" for r in results))
+        self.assertLessEqual(pool._created, 4)
+        self.assertGreaterEqual(pool._created, 1)
+
+    def test_pool_max_uses(self):
+        pool = magic.MagicPool(size=1, max_uses=2, mime=True)
+        with pool.acquire() as first:
+            pass
+        with pool.acquire() as m:
+            self.assertIs(m, first)
+        with pool.acquire() as m:
+            self.assertIsNot(m, first)
+        self.assertEqual(pool.from_buffer(b"%PDF-1.2"), "application/pdf")
+
+        pool.close()
+        self.assertEqual(pool._created, 0)
+
 
 if __name__ == "__main__":
     unittest.main()